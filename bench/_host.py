@@ -0,0 +1,125 @@
+"""
+Stand-ins for the QuecPython builtin modules, so that the `usr.*` modules in
+`src/` can be imported and benchmarked under CPython on a host machine.
+
+Only what the benchmarks touch is provided; this is not an emulator.
+"""
+import os
+import sys
+import io
+import json
+import time
+import types
+import random
+import struct
+import _thread
+import threading
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = _TICKS_PERIOD >> 1
+
+
+def _ticks_diff(end, start):
+    return ((end - start + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+def _make_utime():
+    m = types.ModuleType("utime")
+    m.time = lambda: int(time.time())
+    m.localtime = time.localtime
+    m.sleep = time.sleep
+    m.sleep_ms = lambda ms: time.sleep(ms / 1000.0)
+    m.ticks_ms = lambda: int(time.monotonic() * 1000) & _TICKS_MAX
+    m.ticks_us = lambda: int(time.monotonic() * 1000000) & _TICKS_MAX
+    m.ticks_add = lambda ticks, delta: (ticks + delta) & _TICKS_MAX
+    m.ticks_diff = _ticks_diff
+    return m
+
+
+class _OsTimer(object):
+
+    def __init__(self):
+        self.__timer = None
+
+    def start(self, period, periodic, callback):
+        self.stop()
+        self.__timer = threading.Timer(period / 1000.0, callback, args=(None, ))
+        self.__timer.daemon = True
+        self.__timer.start()
+        return 0
+
+    def stop(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        return 0
+
+
+class FakeWebSocketClient(object):
+    """`uwebsocket.Client` replacement replaying a fixed list of frames."""
+
+    def __init__(self, frames):
+        self.__frames = frames
+        self.__index = 0
+        self.sent = 0
+
+    def recv(self):
+        if self.__index >= len(self.__frames):
+            return None
+        frame = self.__frames[self.__index]
+        self.__index += 1
+        return frame
+
+    def send(self, data):
+        self.sent += 1
+
+    def close(self):
+        pass
+
+
+def install():
+    """register the stand-ins and make `src/` importable as package `usr`"""
+    if "usr" in sys.modules:
+        return
+    urandom = types.ModuleType("urandom")
+    urandom.getrandbits = random.getrandbits
+    uwebsocket = types.ModuleType("uwebsocket")
+    uwebsocket.Client = FakeWebSocketClient
+    stubs = {
+        "utime": _make_utime(),
+        "ujson": json,
+        "uos": os,
+        "uio": io,
+        "ustruct": struct,
+        "urandom": urandom,
+        "osTimer": _OsTimer,
+        "uwebsocket": uwebsocket,
+        "modem": types.ModuleType("modem"),
+        "sys_bus": types.ModuleType("sys_bus"),
+    }
+    for name, module in stubs.items():
+        sys.modules.setdefault(name, module)
+    if not hasattr(_thread, "threadIsRunning"):
+        _thread.threadIsRunning = lambda ident: True
+    if not hasattr(_thread, "stop_thread"):
+        _thread.stop_thread = lambda ident: None
+    if not hasattr(sys, "print_exception"):
+        sys.print_exception = lambda e: sys.stderr.write("{!r}\n".format(e))
+    usr = types.ModuleType("usr")
+    usr.__path__ = [SRC_DIR]
+    sys.modules["usr"] = usr
+
+
+def timeit(func, *args, repeat=5):
+    """return the best wall time (seconds) of `repeat` calls"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
@@ -0,0 +1,87 @@
+"""
+Downlink frame dispatch benchmark (CPython, `uwebsocket` replaced by a stand-in).
+
+before: every frame goes through `json.loads`, audio is detected by the exception.
+after:  `WebSocketClient.__recv_thread_worker` classifies frames by type first.
+
+    python bench/bench_frame_dispatch.py
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _host  # noqa: E402
+
+_host.install()
+
+import ujson as json  # noqa: E402
+from usr.logging import BasicConfig  # noqa: E402
+from usr.protocol import WebSocketClient, JsonMessage, RespHelper  # noqa: E402
+
+FRAMES = 50000
+ROUNDS = 15  # best of N, before and after interleaved so drift hits both alike
+AUDIO_PER_JSON = 16  # ~16 opus packets per second during TTS
+
+
+def make_frames(count):
+    frames = []
+    for i in range(count):
+        if i % (AUDIO_PER_JSON + 1) == AUDIO_PER_JSON:
+            frames.append(json.dumps({"type": "tts", "state": "sentence_start", "text": "hello"}))
+        else:
+            toc = random.choice([0x58, 0x78, 0x98, 0x0b])
+            frames.append(bytes([toc]) + os.urandom(random.randint(60, 200)))
+    return frames
+
+
+def on_audio(raw):
+    pass
+
+
+def on_json(msg):
+    pass
+
+
+def legacy_dispatch(frames):
+    cli = _host.FakeWebSocketClient(frames)
+    while True:
+        raw = cli.recv()
+        if raw is None or raw == "":
+            break
+        try:
+            m = JsonMessage.from_bytes(raw)
+        except Exception:
+            on_audio(raw)
+        else:
+            on_json(m)
+
+
+def current_dispatch(frames):
+    client = WebSocketClient.__new__(WebSocketClient)
+    client.host = "bench"
+    client._WebSocketClient__version = 1
+    client._WebSocketClient__resp_helper = RespHelper()
+    client._WebSocketClient__audio_message_handler = on_audio
+    client._WebSocketClient__json_message_handler = on_json
+    client._WebSocketClient__recv_thread_worker(_host.FakeWebSocketClient(frames))
+
+
+def main():
+    BasicConfig.update(debug=False, level="error")
+    frames = make_frames(FRAMES)
+    before = after = None
+    for _ in range(ROUNDS):
+        elapsed = _host.timeit(legacy_dispatch, frames, repeat=1)
+        before = elapsed if before is None else min(before, elapsed)
+        elapsed = _host.timeit(current_dispatch, frames, repeat=1)
+        after = elapsed if after is None else min(after, elapsed)
+    print("frames: {} ({} audio per json)".format(FRAMES, AUDIO_PER_JSON))
+    print("before: {:>10.0f} frames/s".format(FRAMES / before))
+    print("after:  {:>10.0f} frames/s".format(FRAMES / after))
+    print("speedup: {:.2f}x".format(before / after))
+
+
+if __name__ == "__main__":
+    main()
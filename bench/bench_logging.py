@@ -0,0 +1,70 @@
+"""
+Cost of a filtered `logger.debug()` call (level WARN, debug off), under CPython.
+
+before: the previous `Logger.log` (two `BasicConfig.get` lookups) with the
+        message formatted by the caller.
+after:  `Logger.log` with a cached threshold and deferred formatting.
+
+    python bench/bench_logging.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _host  # noqa: E402
+
+_host.install()
+
+from usr.logging import BasicConfig, Level, getLogger  # noqa: E402
+
+CALLS = 200000
+DEVICE_INFO = {"mac_address": "00:11:22:33:44:55", "uuid": "3f2a", "version": 3}
+
+
+class LegacyLogger(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def log(self, level, *message):
+        if not BasicConfig.get("debug"):
+            if level < BasicConfig.get("level"):
+                return
+        raise AssertionError("filtered call must not be emitted")
+
+    def debug(self, *message):
+        self.log(Level.DEBUG, *message)
+
+
+def before(logger, n):
+    for i in range(n):
+        logger.debug("device info: {} {}".format(i, DEVICE_INFO))
+
+
+def after(logger, n):
+    for i in range(n):
+        logger.debug("device info: {} {}", i, DEVICE_INFO)
+
+
+def after_guarded(logger, n):
+    for i in range(n):
+        if logger.isEnabledFor(Level.DEBUG):
+            logger.debug("device info: {} {}", i, DEVICE_INFO)
+
+
+def main():
+    BasicConfig.update(debug=False, level="warn")
+    legacy = LegacyLogger("bench")
+    logger = getLogger("bench")
+    results = (
+        ("before", _host.timeit(before, legacy, CALLS)),
+        ("after", _host.timeit(after, logger, CALLS)),
+        ("after (isEnabledFor)", _host.timeit(after_guarded, logger, CALLS)),
+    )
+    for name, elapsed in results:
+        print("{:<22}{:>8.0f} ns/call".format(name, elapsed / CALLS * 1e9))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+`usr.threading.Queue` put/get throughput at several depths, under CPython.
+
+before: list storage (`append` / `pop(0)`), as the queue used to be.
+after:  the preallocated circular buffer.
+
+Both variants share the same locking, so only the storage cost differs; the
+second table calls the storage hooks directly to show it without lock overhead.
+On CPython `list.pop(0)` is a fast memmove, the gap is much wider on the
+MicroPython heap, where the list also has to grow and shrink.
+
+The last table moves the same items with `put_many` / `get_many` (one lock
+acquisition and one wake-up per batch) instead of item by item.
+
+    python bench/bench_queue.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _host  # noqa: E402
+
+_host.install()
+
+from usr.threading import Queue  # noqa: E402
+
+DEPTHS = (10, 100, 1000)
+OPERATIONS = 100000
+
+
+class ListQueue(Queue):
+
+    def _init(self, max_size):
+        self.queue = []
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, item):
+        self.queue.append(item)
+
+    def _get(self):
+        return self.queue.pop(0)
+
+    def _clear(self):
+        self.queue.clear()
+
+
+def fill_and_drain(queue, depth, rounds):
+    for _ in range(rounds):
+        for i in range(depth):
+            queue.put(i)
+        for _ in range(depth):
+            queue.get()
+
+
+def fill_and_drain_storage(queue, depth, rounds):
+    put = queue._put
+    get = queue._get
+    for _ in range(rounds):
+        for i in range(depth):
+            put(i)
+        for _ in range(depth):
+            get()
+
+
+def fill_and_drain_batched(queue, depth, rounds):
+    items = list(range(depth))
+    for _ in range(rounds):
+        queue.put_many(items)
+        queue.get_many(depth)
+
+
+def report(title, func):
+    print(title)
+    print("{:>6} {:>14} {:>14} {:>8}".format("depth", "before ops/s", "after ops/s", "speedup"))
+    for depth in DEPTHS:
+        rounds = max(1, OPERATIONS // depth)
+        ops = rounds * depth * 2
+        before = _host.timeit(func, ListQueue(depth), depth, rounds, repeat=3)
+        after = _host.timeit(func, Queue(depth), depth, rounds, repeat=3)
+        print("{:>6} {:>14.0f} {:>14.0f} {:>7.2f}x".format(depth, ops / before, ops / after, before / after))
+
+
+def main():
+    report("put/get (with locking)", fill_and_drain)
+    report("storage only", fill_and_drain_storage)
+    print("batched put_many/get_many")
+    print("{:>6} {:>14} {:>14} {:>8}".format("depth", "single ops/s", "batch ops/s", "speedup"))
+    for depth in DEPTHS:
+        rounds = max(1, OPERATIONS // depth)
+        ops = rounds * depth * 2
+        single = _host.timeit(fill_and_drain, Queue(depth), depth, rounds, repeat=3)
+        batched = _host.timeit(fill_and_drain_batched, Queue(depth), depth, rounds, repeat=3)
+        print("{:>6} {:>14.0f} {:>14.0f} {:>7.2f}x".format(depth, ops / single, ops / batched, single / batched))
+
+
+if __name__ == "__main__":
+    main()
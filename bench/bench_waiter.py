@@ -0,0 +1,78 @@
+"""
+`Condition.wait` cost with and without the `_Waiter` pool, under CPython.
+
+Two threads ping-pong through a pair of `usr.threading.Queue`s, so every
+`get` blocks on a condition with a timeout (lock + timer per waiter).
+
+before: `_Waiter.POOL_SIZE = 0`, every wait builds a new waiter.
+after:  the default pool, waiters and their timers are reused.
+
+The waiter count is the figure that carries over to the device, where each
+waiter is a lock plus a `Timer` on the heap.
+
+    python bench/bench_waiter.py
+"""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _host  # noqa: E402
+
+_host.install()
+
+from usr.threading import Queue, _Waiter  # noqa: E402
+
+ROUNDS = 2000
+
+
+def ping_pong(rounds):
+    ping = Queue(1)
+    pong = Queue(1)
+
+    def echo():
+        for _ in range(rounds):
+            pong.put(ping.get(timeout=5))
+
+    t = threading.Thread(target=echo)
+    t.start()
+    for i in range(rounds):
+        ping.put(i)
+        pong.get(timeout=5)
+    t.join()
+
+
+BUILT = [0]
+
+
+def counting_init(init):
+    def __init__(waiter):
+        BUILT[0] += 1
+        init(waiter)
+    return __init__
+
+
+def measure(pool_size):
+    _Waiter.POOL_SIZE = pool_size
+    ping_pong(100)  # warm the pool
+    elapsed = _host.timeit(ping_pong, ROUNDS, repeat=3)
+    BUILT[0] = 0
+    ping_pong(ROUNDS)
+    return elapsed, BUILT[0]
+
+
+def main():
+    default = _Waiter.POOL_SIZE
+    init = _Waiter.__init__
+    _Waiter.__init__ = counting_init(init)
+    for name, pool_size in (("before", 0), ("after", default)):
+        elapsed, built = measure(pool_size)
+        print("{:<8}{:>8.1f} us/round trip {:>6} waiters built for {} round trips".format(
+            name, elapsed / ROUNDS * 1e6, built, ROUNDS))
+    _Waiter.__init__ = init
+    _Waiter.POOL_SIZE = default
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
+import uos
 import utime
+import ustruct
 import sys
 import uio as io
 import _thread
+from usr.threading import Lock, Thread, Timer, heartbeat
 
 
 class Level(object):
@@ -47,13 +50,20 @@ class BasicConfig(object):
     basic_configure = {
         "level": Level.WARN,
         "debug": True,
-        "stream": sys.stdout
+        "stream": sys.stdout,
+        "sink": None,
+        "levels": {}  # per-logger level overrides, e.g. {"usr.protocol": "DEBUG"}
     }
+    # lowest level to be emitted, derived from "debug" and "level"
+    threshold = Level.DEBUG
+    # AsyncSink instance, None means writing to stream in caller's thread
+    sink = None
 
     @classmethod
     def getLogger(cls, name):
         if name not in cls.logger_register_table:
             logger = Logger(name)
+            logger.threshold = cls.__threshold_of(name)
             cls.logger_register_table[name] = logger
         else:
             logger = cls.logger_register_table[name]
@@ -64,7 +74,11 @@ class BasicConfig(object):
         level = kwargs.pop("level", None)
         if level is not None:
             kwargs["level"] = getNameLevel(level)
-        return cls.basic_configure.update(kwargs)
+        levels = kwargs.pop("levels", None)
+        if levels is not None:
+            kwargs["levels"] = cls.__parse_levels(levels)
+        cls.basic_configure.update(kwargs)
+        cls.__refresh()
 
     @classmethod
     def get(cls, key):
@@ -74,20 +88,67 @@ class BasicConfig(object):
     def set(cls, key, value):
         if key == "level":
             value = getNameLevel(value)
+        elif key == "levels":
+            value = cls.__parse_levels(value)
         cls.basic_configure[key] = value
+        cls.__refresh()
+
+    @classmethod
+    def __refresh(cls):
+        if cls.basic_configure["debug"]:
+            cls.threshold = Level.DEBUG
+        else:
+            cls.threshold = cls.basic_configure["level"]
+        cls.sink = cls.basic_configure["sink"]
+        for name, logger in cls.logger_register_table.items():
+            logger.threshold = cls.__threshold_of(name)
+
+    @classmethod
+    def setLevel(cls, name, level):
+        """override level of logger `name`, level None to remove the override"""
+        levels = dict(cls.basic_configure["levels"])
+        if level is None:
+            levels.pop(name, None)
+        else:
+            levels[name] = level
+        cls.set("levels", levels)
+
+    @staticmethod
+    def __parse_levels(levels):
+        parsed = {}
+        for name, level in levels.items():
+            parsed[name] = getNameLevel(level) if isinstance(level, str) else level
+        return parsed
+
+    @classmethod
+    def __threshold_of(cls, name):
+        level = cls.basic_configure["levels"].get(name)
+        if level is not None:
+            return level
+        return cls.threshold
 
 
 class Logger(object):
-    lock = _thread.allocate_lock()
+    lock = Lock("logging")
+    # (second, "[YYYY-mm-dd HH:MM:SS]"), shared by all loggers
+    __time_prefix = (None, "")
 
     def __init__(self, name):
         self.name = name
+        # lowest level emitted by this logger, maintained by BasicConfig
+        self.threshold = BasicConfig.threshold
+        self.__tags = {}
+        for level, level_name in _levelToName.items():
+            self.__tags[level] = "[{}][{}]".format(level_name, name)
 
-    @staticmethod
-    def __getFormattedTime():
+    @classmethod
+    def formatTime(cls, now):
+        cached = cls.__time_prefix
+        if cached[0] == now:
+            return cached[1]
         # (2023, 9, 30, 11, 11, 41, 5, 273)
-        cur_time_tuple = utime.localtime()
-        return "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
+        cur_time_tuple = utime.localtime(now)
+        prefix = "[{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}]".format(
             cur_time_tuple[0],
             cur_time_tuple[1],
             cur_time_tuple[2],
@@ -95,22 +156,114 @@ class Logger(object):
             cur_time_tuple[4],
             cur_time_tuple[5]
         )
+        cls.__time_prefix = (now, prefix)
+        return prefix
 
-    def log(self, level, *message):
-        if not BasicConfig.get("debug"):
-            if level < BasicConfig.get("level"):
-                return
+    @staticmethod
+    def formatMessage(message):
+        """lazy formatting: log("fmt {} {}", a, b) is formatted only when emitted"""
+        if len(message) > 1:
+            fmt = message[0]
+            if isinstance(fmt, str) and "{" in fmt:
+                try:
+                    return (fmt.format(*message[1:]), )
+                except Exception:
+                    pass
+        return message
+
+    @classmethod
+    def write(cls, now, tag, message):
         stream = BasicConfig.get("stream")
-        prefix = "[{}][{}][{}]".format(
-            self.__getFormattedTime(),
-            getLevelName(level),
-            self.name,
-        )
-        with self.lock:
+        prefix = cls.formatTime(now) + tag
+        message = cls.formatMessage(message)
+        with cls.lock:
             print(prefix, *message, file=stream)
             if isinstance(stream, io.TextIOWrapper):
                 stream.flush()
 
+    def isEnabledFor(self, level):
+        return level >= self.threshold
+
+    def limit(self, every=None, per_second=None):
+        """return a rate-limited view of this logger for per-frame hot paths"""
+        return RateLimitedLogger(self, every=every, per_second=per_second)
+
+    def log(self, level, *message):
+        if level < self.threshold:
+            return
+        if level not in self.__tags:
+            getLevelName(level)
+        sink = BasicConfig.sink
+        if sink is not None:
+            sink.emit(utime.time(), self.__tags[level], message)
+        else:
+            self.write(utime.time(), self.__tags[level], message)
+
+    def debug(self, *message):
+        self.log(Level.DEBUG, *message)
+
+    def info(self, *message):
+        self.log(Level.INFO, *message)
+
+    def warn(self, *message):
+        self.log(Level.WARN, *message)
+
+    def error(self, *message):
+        self.log(Level.ERROR, *message)
+
+    def critical(self, *message):
+        self.log(Level.CRITICAL, *message)
+
+
+class RateLimitedLogger(object):
+    """Rate-limited view of a `Logger`.
+
+    `every=N` emits 1 in N records, `per_second=K` emits at most K records per
+    second; the number of suppressed records is appended to the next emitted one.
+    The level check happens first, so disabled frame-level logs cost one compare.
+    """
+
+    def __init__(self, logger, every=None, per_second=None):
+        if every is None and per_second is None:
+            raise ValueError("either every or per_second is required.")
+        self.logger = logger
+        self.every = every
+        self.per_second = per_second
+        self.suppressed = 0
+        self.__counter = 0
+        self.__window_start = utime.ticks_ms()
+        self.__window_count = 0
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def __allow(self):
+        if self.every is not None:
+            self.__counter += 1
+            if self.__counter < self.every:
+                return False
+            self.__counter = 0
+        if self.per_second is not None:
+            now = utime.ticks_ms()
+            if utime.ticks_diff(now, self.__window_start) >= 1000:
+                self.__window_start = now
+                self.__window_count = 0
+            if self.__window_count >= self.per_second:
+                return False
+            self.__window_count += 1
+        return True
+
+    def log(self, level, *message):
+        if level < self.logger.threshold:
+            return
+        if not self.__allow():
+            self.suppressed += 1
+            return
+        if self.suppressed:
+            message = Logger.formatMessage(message) + ("({} suppressed)".format(self.suppressed), )
+            self.suppressed = 0
+        self.logger.log(level, *message)
+
     def debug(self, *message):
         self.log(Level.DEBUG, *message)
 
@@ -127,5 +280,248 @@ class Logger(object):
         self.log(Level.CRITICAL, *message)
 
 
+# arguments of these types cannot change between emit() and the drain thread
+_SCALAR_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+class AsyncSink(object):
+    """Ring-buffer log sink.
+
+    `emit()` only stores (time, tag, message) into preallocated slots; a single
+    background thread formats the records and writes them to the stream, so
+    callers never block on a slow console. records carrying mutable arguments
+    (dicts, lists, objects) are formatted in `emit()` instead, so the log shows
+    their value at call time. enable with `BasicConfig.update(sink=AsyncSink())`.
+    """
+    DROP_NEWEST = 0
+    DROP_OLDEST = 1
+    DRAIN_DEADLINE = 5  # seconds a single write may take before the drain thread counts as stalled
+
+    def __init__(self, capacity=64, policy=DROP_NEWEST):
+        if capacity <= 0:
+            raise ValueError("capacity must be greater than 0.")
+        if policy not in (self.DROP_NEWEST, self.DROP_OLDEST):
+            raise ValueError("invalid policy: {}".format(policy))
+        self.policy = policy
+        self.dropped = 0
+        self.__capacity = capacity
+        self.__times = [0] * capacity
+        self.__tags = [None] * capacity
+        self.__messages = [None] * capacity
+        self.__head = 0
+        self.__count = 0
+        self.__reported_dropped = 0
+        self.__lock = _thread.allocate_lock()
+        # binary semaphore, released when the buffer becomes non-empty
+        self.__ready = _thread.allocate_lock()
+        self.__ready.acquire()
+        self.__thread = Thread(target=self.__drain_thread_worker, name="log_sink")
+        self.__thread.start()
+
+    def emit(self, now, tag, message):
+        for arg in message:
+            if not isinstance(arg, _SCALAR_TYPES):
+                message = tuple(str(m) for m in Logger.formatMessage(message))
+                break
+        with self.__lock:
+            if self.__count == self.__capacity:
+                self.dropped += 1
+                if self.policy == self.DROP_NEWEST:
+                    return
+                self.__pop()
+            tail = (self.__head + self.__count) % self.__capacity
+            self.__times[tail] = now
+            self.__tags[tail] = tag
+            self.__messages[tail] = message
+            self.__count += 1
+            wakeup = self.__count == 1
+        if wakeup:
+            try:
+                self.__ready.release()
+            except RuntimeError:
+                pass
+
+    def pending(self):
+        with self.__lock:
+            return self.__count
+
+    def __pop(self):
+        head = self.__head
+        record = (self.__times[head], self.__tags[head], self.__messages[head])
+        self.__tags[head] = None
+        self.__messages[head] = None
+        self.__head = (head + 1) % self.__capacity
+        self.__count -= 1
+        return record
+
+    def __drain_thread_worker(self):
+        while True:
+            # idle until the next record, not watched while parked
+            heartbeat()
+            self.__ready.acquire()
+            while True:
+                with self.__lock:
+                    if self.__count == 0:
+                        break
+                    record = self.__pop()
+                    dropped = self.dropped - self.__reported_dropped
+                    self.__reported_dropped = self.dropped
+                heartbeat(self.DRAIN_DEADLINE)
+                try:
+                    if dropped:
+                        Logger.write(record[0], "[WARN][logging]", ("{} records dropped".format(dropped), ))
+                    Logger.write(*record)
+                except Exception:
+                    pass
+
+
+_StreamBase = getattr(io, "IOBase", object)
+
+
+class RotatingFileStream(_StreamBase):
+    """Compact, rotating log file on flash, used as `BasicConfig` stream.
+
+    Every line written becomes a length-prefixed record (type: u8, length: u16,
+    big-endian, then utf-8 payload). Records are batched in a block-sized buffer
+    and written to flash one block at a time to limit wear; when the current file
+    would exceed `max_bytes` it is rotated to `path.1` ... `path.<backup_count>`.
+    A partial block is flushed every `flush_interval` seconds by a timer on the
+    shared wheel, and on `close()`.
+    Decode on host with `tools/decode_log.py`. Pair with `AsyncSink` so flash
+    writes never happen on hot threads:
+
+        BasicConfig.update(stream=RotatingFileStream(), sink=AsyncSink())
+    """
+    RECORD_LOG = 1
+    RECORD_EVENT = 2  # payload: u32 timestamp + utf-8 text
+    HEADER_FORMAT = ">BH"
+    HEADER_SIZE = 3
+
+    def __init__(self, path="/usr/app.log", max_bytes=64 * 1024, backup_count=3, block_size=4096,
+                 max_record=512, flush_interval=5):
+        if max_record + self.HEADER_SIZE > block_size:
+            raise ValueError("max_record must fit in one block.")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.__block = bytearray(block_size)
+        self.__block_view = memoryview(self.__block)
+        self.__block_used = 0
+        self.__record = bytearray(max_record)
+        self.__record_view = memoryview(self.__record)
+        self.__record_used = 0
+        self.__lock = _thread.allocate_lock()
+        self.__file = None
+        try:
+            self.__file_size = uos.stat(path)[6]
+        except OSError:
+            self.__file_size = 0
+        self.__flush_timer = Timer(self.flush)
+        self.__flush_timer.start(flush_interval, period=flush_interval)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        with self.__lock:
+            start = 0
+            while True:
+                end = data.find(b"\n", start)
+                self.__append(data, start, len(data) if end < 0 else end)
+                if end < 0:
+                    break
+                self.__commit(self.RECORD_LOG, self.__record_used)
+                start = end + 1
+        return len(data)
+
+    def event(self, tag, *fields):
+        """append an event record to the journal"""
+        text = " ".join([tag] + [str(field) for field in fields]).encode()
+        # Logger.lock keeps the event from splitting a line being printed
+        with Logger.lock, self.__lock:
+            self.__record_used = 0
+            ustruct.pack_into(">I", self.__record, 0, utime.time() & 0xFFFFFFFF)
+            self.__record_used = 4
+            self.__append(text, 0, len(text))
+            self.__commit(self.RECORD_EVENT, self.__record_used)
+
+    def flush(self):
+        with self.__lock:
+            self.__flush_block()
+
+    def close(self):
+        self.__flush_timer.cancel()
+        with self.__lock:
+            self.__flush_block()
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def __append(self, data, start, end):
+        # over-long records are truncated
+        n = min(end - start, len(self.__record) - self.__record_used)
+        if n > 0:
+            self.__record_view[self.__record_used:self.__record_used + n] = data[start:start + n]
+            self.__record_used += n
+
+    def __commit(self, record_type, length):
+        self.__record_used = 0
+        if self.__block_used + self.HEADER_SIZE + length > len(self.__block):
+            self.__flush_block()
+        ustruct.pack_into(self.HEADER_FORMAT, self.__block, self.__block_used, record_type, length)
+        self.__block_used += self.HEADER_SIZE
+        self.__block_view[self.__block_used:self.__block_used + length] = self.__record_view[:length]
+        self.__block_used += length
+
+    def __flush_block(self):
+        if self.__block_used == 0:
+            return
+        try:
+            if self.__file_size + self.__block_used > self.max_bytes:
+                self.__rotate()
+            if self.__file is None:
+                self.__file = open(self.path, "ab")
+            self.__file.write(self.__block_view[:self.__block_used])
+            self.__file.flush()
+            self.__file_size += self.__block_used
+        except Exception as e:
+            sys.print_exception(e)
+        self.__block_used = 0
+
+    def __rotate(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        for i in range(self.backup_count, 0, -1):
+            src = self.path if i == 1 else "{}.{}".format(self.path, i - 1)
+            dst = "{}.{}".format(self.path, i)
+            try:
+                uos.remove(dst)
+            except OSError:
+                pass
+            try:
+                uos.rename(src, dst)
+            except OSError:
+                pass
+        if self.backup_count <= 0:
+            try:
+                uos.remove(self.path)
+            except OSError:
+                pass
+        self.__file_size = 0
+
+
 def getLogger(name):
     return BasicConfig.getLogger(name)
+
+
+def getFrameLogger(name, per_second=1):
+    """rate-limited logger `<name>.frames` for per-frame hot paths.
+
+    Off (WARN) by default even when "debug" is on, enable at runtime with
+    `BasicConfig.setLevel("<name>.frames", "DEBUG")`.
+    """
+    name = name + ".frames"
+    if name not in BasicConfig.get("levels"):
+        BasicConfig.setLevel(name, Level.WARN)
+    return getLogger(name).limit(per_second=per_second)
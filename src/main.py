@@ -4,15 +4,21 @@
 import utime
 import gc
 from machine import ExtInt,Pin
-from usr.protocol import WebSocketClient
-from usr.utils import ChargeManager, AudioManager, NetManager, TaskManager
-from usr.threading import Thread, Event, Condition
-from usr.logging import getLogger
+from usr.protocol import WebSocketClient, ConnectionManager, UplinkSender
+from usr.utils import ChargeManager, AudioManager, NetManager, TaskManager, JitterBuffer
+from usr.threading import Thread, Event, Lock, Timer, heartbeat, ThreadRegistry
+from usr.logging import getLogger, getFrameLogger
 import sys_bus
 # from usr import UI
 
 
 logger = getLogger(__name__)
+# 逐帧日志限速且默认关闭，运行时通过 BasicConfig.setLevel(__name__ + ".frames", "DEBUG") 开启
+frame_logger = getFrameLogger(__name__)
+
+
+CHAT_IDLE_TIMEOUT = 30  # 无人声且无下行音频超过该时间(秒)结束会话，WebSocket连接保持
+LOOP_DEADLINE = 2  # 采集循环两次心跳的最大间隔(秒)，超过即报告卡顿
 
 
 
@@ -28,49 +34,56 @@ class Led(object):
         self.__off_period = 1000
         self.__on_period = 1000
         self.__count = 0
-        self.__running_cond = Condition()
-        self.__blink_thread = None
+        self.__lock = Lock("led")
+        # 闪烁由共享的 TimerWheel 驱动，每个 LED 不再占用一个线程
+        self.__blink_timer = Timer(self.__toggle, inline=True)
         self.off()
 
     @property
     def status(self):
-        with self.__running_cond:
+        with self.__lock:
             return self.__led.read()
 
     def on(self):
-        with self.__running_cond:
+        with self.__lock:
             self.__count = 0
+            self.__blink_timer.cancel()
             return self.__led.write(0)
 
     def off(self):
-        with self.__running_cond:
+        with self.__lock:
             self.__count = 0
+            self.__blink_timer.cancel()
             return self.__led.write(1)
 
     def blink(self, on_period=50, off_period=50, count=None):
         if not isinstance(count, (int, type(None))):
             raise TypeError('count must be int or None type')
-        with self.__running_cond:
-            if self.__blink_thread is None:
-                self.__blink_thread = Thread(target=self.__blink_thread_worker)
-                self.__blink_thread.start()
+        with self.__lock:
             self.__on_period = on_period
             self.__off_period = off_period
             self.__count = count
-            self.__running_cond.notify_all()
-
-    def __blink_thread_worker(self):
-        while True:
-            with self.__running_cond:
-                if self.__count is not None:
-                    self.__running_cond.wait_for(lambda: self.__count is None or self.__count > 0)
-                status = self.__led.read()
-                self.__led.write(1 - status)
-                utime.sleep_ms(self.__on_period if status else self.__off_period)
-                self.__led.write(status)
-                utime.sleep_ms(self.__on_period if status else self.__off_period)
-                if self.__count is not None:
-                    self.__count -= 1
+            if count is None or count > 0:
+                self.__blink_timer.start(0)
+            else:
+                self.__blink_timer.cancel()
+
+    def __toggle(self):
+        with self.__lock:
+            if self.__count is not None and self.__count <= 0:
+                return
+            status = self.__led.read()
+            self.__led.write(1 - status)
+            if status:
+                # 灭 -> 亮
+                self.__blink_timer.start(self.__on_period / 1000)
+                return
+            # 亮 -> 灭，完成一次闪烁
+            if self.__count is not None:
+                self.__count -= 1
+                if self.__count <= 0:
+                    return
+            self.__blink_timer.start(self.__off_period / 1000)
 
 class Application(object):
 
@@ -95,6 +108,7 @@ class Application(object):
         self.audio_manager = AudioManager()
         self.audio_manager.set_kws_cb(self.on_keyword_spotting)
         self.audio_manager.set_vad_cb(self.on_voice_activity_detection)
+        self.jitter_buffer = JitterBuffer(self.audio_manager)
 
         # 初始化网络管理
         self.net_manager = NetManager()
@@ -108,28 +122,44 @@ class Application(object):
             audio_message_handler=self.on_audio_message,
             json_message_handler=self.on_json_message
         )
+        self.__connection = ConnectionManager(self.__protocol)
+        self.__uplink = UplinkSender(self.__protocol)
+        self.__last_activity = utime.time()
 
         self.__working_thread = None
         self.__record_thread = None
         self.__record_thread_stop_event = Event()
         self.__voice_activity_event = Event()
         self.__keyword_spotting_event = Event()
+        self.__kws_running = False
 
     def __record_thread_handler(self):
-        """纯粹是为了kws&vad能识别才起的线程持续读音频"""
+        """纯粹是为了kws&vad能识别才起的线程持续读音频
+
+        调用 stop_kws 或 kws 结束(__keyword_spotting_event)后，最迟在读完当前一帧并让出 5ms 后退出，
+        把麦克风让给会话
+        """
         logger.debug("record thread handler enter")
-        while not self.__record_thread_stop_event.is_set():
+        stop_event = self.__record_thread_stop_event
+        kws_event = self.__keyword_spotting_event
+        while not (stop_event.is_set() or kws_event.is_set()):
+            heartbeat(LOOP_DEADLINE)
             self.audio_manager.opus_read()
             utime.sleep_ms(5)
         logger.debug("record thread handler exit")
 
     def start_kws(self):
         self.audio_manager.start_kws()
+        self.__kws_running = True
         self.__record_thread_stop_event.clear()
-        self.__record_thread = Thread(target=self.__record_thread_handler)
+        self.__keyword_spotting_event.clear()
+        self.__record_thread = Thread(target=self.__record_thread_handler, name="record")
         self.__record_thread.start(stack_size=64)
     
     def stop_kws(self):
+        if not self.__kws_running:
+            return
+        self.__kws_running = False
         self.__record_thread_stop_event.set()
         self.__record_thread.join()
         self.audio_manager.stop_kws()
@@ -141,74 +171,108 @@ class Application(object):
         self.audio_manager.stop_vad()
 
     def __working_thread_handler(self):
-        t = Thread(target=self.__chat_process)
-        t.start(stack_size=64)
-        self.__keyword_spotting_event.wait()
-        self.stop_kws()
-        t.join()
-        self.start_kws()
+        # 会话直接在工作线程中进行，不再为等待 kws 事件额外起线程
+        try:
+            self.__chat_process()
+        finally:
+            self.stop_kws()
+            # 会话已结束，此时下载固件不会打断对话
+            self.__protocol.check_firmware_update()
+            self.start_kws()
 
     def __chat_process(self):
         self.start_vad()
         try:
-            with self.__protocol:
+            with self.__connection:
                 self.power_red_led.on()
-                self.__protocol.hello()
+                self.__apply_audio_params(
+                    self.__protocol.hello(self.audio_manager.sample_rate, self.audio_manager.frame_duration)
+                )
                 self.__protocol.wakeword_detected("小智")
                 is_listen_flag = False
+                self.__last_activity = utime.time()
                 while True:
+                    heartbeat(LOOP_DEADLINE)
+                    if self.__keyword_spotting_event.is_set():
+                        # kws 已结束，录音线程已自行退出
+                        self.stop_kws()
                     data = self.audio_manager.opus_read()
                     if self.__voice_activity_event.is_set():
                         # 有人声
                         if not is_listen_flag:
                             self.__protocol.listen("start")
                             is_listen_flag = True
-                        self.__protocol.send(data)
-                        # logger.debug("send opus data to server")
+                        self.__uplink.put(data)
+                        self.__last_activity = utime.time()
+                        frame_logger.debug("send opus data to server")
                     else:
                         if is_listen_flag:
+                            # 保证 stop 之前的音频帧先到达服务器
+                            self.__uplink.flush(timeout=1)
                             self.__protocol.listen("stop")
                             is_listen_flag = False
+                        if utime.time() - self.__last_activity > CHAT_IDLE_TIMEOUT:
+                            logger.info("chat idle timeout, end session")
+                            break
                     if not self.__protocol.is_state_ok():
                         break
-                    # logger.debug("read opus data length: {}".format(len(data)))
+                    frame_logger.debug("read opus data length: {}", len(data))
         except Exception as e:
-            logger.debug("working thread handler got Exception: {}".format(repr(e)))
+            logger.debug("working thread handler got Exception: {}", repr(e))
         finally:
+            heartbeat()
+            self.__uplink.clear()
             self.power_red_led.blink(250, 250)
             self.stop_vad()
 
+    def __apply_audio_params(self, resp):
+        """按 hello 响应中服务器的音频参数重新配置编解码，避免两端重采样和帧长不匹配"""
+        if resp is None:
+            logger.warn("hello response timeout, keep audio params")
+            return
+        params = resp.kwargs.get("audio_params") or {}
+        sample_rate = params.get("sample_rate", self.audio_manager.sample_rate)
+        frame_duration = params.get("frame_duration", self.audio_manager.frame_duration)
+        if self.audio_manager.configure_opus(sample_rate, frame_duration):
+            self.jitter_buffer.frame_duration = frame_duration
+
     def on_talk_key_click(self, args):
         logger.info("on_talk_key_click: ", args)
         if self.__working_thread is not None and self.__working_thread.is_running():
             return
-        self.__working_thread = Thread(target=self.__working_thread_handler)
-        self.__working_thread.start()
+        self.__working_thread = Thread(target=self.__working_thread_handler, name="chat")
+        self.__working_thread.start(stack_size=64)
         
     def on_keyword_spotting(self, state):
-        logger.info("on_keyword_spotting: {}".format(state))
+        logger.info("on_keyword_spotting: {}", state)
         if state == 0:
             # 唤醒词触发
             if self.__working_thread is not None and self.__working_thread.is_running():
                 return
-            self.__working_thread = Thread(target=self.__working_thread_handler)
-            self.__working_thread.start()
+            # 先清除再启动，避免录音线程看到上一次会话遗留的事件
             self.__keyword_spotting_event.clear()
+            self.__working_thread = Thread(target=self.__working_thread_handler, name="chat")
+            self.__working_thread.start(stack_size=64)
         else:
             self.__keyword_spotting_event.set()
 
     def on_voice_activity_detection(self, state):
         gc.collect()
-        logger.info("on_voice_activity_detection: {}".format(state))
+        logger.info("on_voice_activity_detection: {}", state)
         if state == 1:
             self.__protocol.abort()
+            self.jitter_buffer.clear()
             self.__voice_activity_event.set()  # 有人声
         else:
             self.__voice_activity_event.clear()  # 无人声
 
+    def on_thread_stall(self, thread, gap_ms):
+        logger.warn("{} stalled: no heartbeat for {}ms, threads: {}", thread, gap_ms, ThreadRegistry.table())
+
     def on_audio_message(self, raw):
         # raise NotImplementedError("on_audio_message not implemented")
-        self.audio_manager.opus_write(raw)
+        self.__last_activity = utime.time()
+        self.jitter_buffer.put(raw)
 
     def on_json_message(self, msg):
         return getattr(self, "handle_{}_message".format(msg["type"]))(msg)
@@ -221,6 +285,7 @@ class Application(object):
         if state == "start":
             self.wifi_green_led.blink(250, 250)
         elif state == "stop":
+            self.jitter_buffer.end_stream()
             self.wifi_green_led.off()
         else:
             pass
@@ -238,6 +303,11 @@ class Application(object):
     def run(self):
         self.charge_manager.enable_charge()
         self.audio_manager.open_opus()
+        self.__protocol.check_firmware_update()
+        self.jitter_buffer.start()
+        self.__uplink.start()
+        self.__connection.start()
+        ThreadRegistry.watch(callback=self.on_thread_stall)
         self.talk_key.enable()
         self.start_kws()
         self.led_power_pin.write(1)
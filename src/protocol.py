@@ -1,20 +1,304 @@
 import modem
 import uos
+import utime
+import ustruct
 import ujson as json
 from usr import uuid
 import uwebsocket as ws
-from usr.threading import Thread, Condition
-from usr.logging import getLogger
+from usr.threading import Thread, Condition, Lock, Event, Timer, Future
+from usr.logging import getLogger, getFrameLogger, Level
 import sys_bus
 
 
 
 logger = getLogger(__name__)
+# 逐帧日志限速且默认关闭，运行时通过 BasicConfig.setLevel(__name__ + ".frames", "DEBUG") 开启
+frame_logger = getFrameLogger(__name__)
 
 
 WSS_DEBUG = True
 PROTOCOL_VERSION = "1"
+SUPPORTED_PROTOCOL_VERSIONS = (1, 2, 3)
+# 二进制协议帧头(网络字节序)
+# v2: version(u16) type(u16) reserved(u32) timestamp(u32) payload_size(u32)
+# v3: type(u8) reserved(u8) payload_size(u16)
+BINARY_HEADER_V2 = ">HHIII"
+BINARY_HEADER_V2_SIZE = 16
+BINARY_HEADER_V3 = ">BBH"
+BINARY_HEADER_V3_SIZE = 4
+BINARY_TYPE_OPUS = 0
+BINARY_TYPE_JSON = 1
+MAX_AUDIO_PAYLOAD = 1024
+WS_OPCODE_BINARY = 0x2
+WS_OPCODE_PING = 0x9
+KEEPALIVE_INTERVAL = 30  # 空闲时发送ping保活的间隔(秒)
+IDLE_TIMEOUT = 300  # 无会话超过该时间(秒)后断开长连接
 OTA_DOWNLOAD_URL= "http://wechat-mini-static.robomon.cn/OTA/"
+OTA_CACHE_FILE = "/usr/ota_cache.json"
+OTA_CACHE_VERSION = 1
+OTA_CACHE_TTL = 24 * 60 * 60  # 缓存有效期(秒)，过期的缓存仍可使用，只在日志中提示
+
+
+HTTP_RECV_BUFFER_SIZE = 2048  # 无Content-Length时接收缓冲区的初始大小
+DNS_CACHE_TTL = 10 * 60  # DNS解析结果缓存时间(秒)
+SERIAL_NUMBER = "JJZL_SILICORE_1_FCFCB75053D9870E"
+
+
+class HttpResponse(object):
+    """HTTP响应，body 为指向接收缓冲区的 memoryview，不做额外拷贝"""
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # 头部字段名均为小写
+        self.body = body
+
+    def text(self, encoding="utf-8"):
+        return str(self.body, encoding)
+
+    def json(self):
+        return json.loads(self.text())
+
+
+def _readinto(sock, mv):
+    readinto = getattr(sock, "readinto", None)
+    if readinto is not None:
+        return readinto(mv) or 0
+    data = sock.read(len(mv))
+    if not data:
+        return 0
+    mv[:len(data)] = data
+    return len(data)
+
+
+def _read_exactly(sock, mv):
+    pos = 0
+    while pos < len(mv):
+        n = _readinto(sock, mv[pos:])
+        if not n:
+            raise OSError("connection closed, received {} of {} bytes".format(pos, len(mv)))
+        pos += n
+
+
+def _grow_buffer(buf, used, required):
+    new_buf = bytearray(max(len(buf) * 2, required))
+    memoryview(new_buf)[:used] = memoryview(buf)[:used]
+    return new_buf
+
+
+def _read_chunked_body(sock, size_hint):
+    buf = bytearray(size_hint)
+    used = 0
+    while True:
+        line = sock.readline()
+        if not line:
+            raise OSError("connection closed in chunked body")
+        size = int(line.split(b";", 1)[0].strip(), 16)
+        if size == 0:
+            # 跳过 trailer 部分
+            while True:
+                line = sock.readline()
+                if not line or line == b"\r\n":
+                    break
+            return memoryview(buf)[:used]
+        if used + size > len(buf):
+            buf = _grow_buffer(buf, used, used + size)
+        _read_exactly(sock, memoryview(buf)[used:used + size])
+        used += size
+        sock.readline()  # chunk 结尾的 CRLF
+
+
+def _read_body_until_close(sock, size_hint):
+    buf = bytearray(size_hint)
+    used = 0
+    while True:
+        if used == len(buf):
+            buf = _grow_buffer(buf, used, used + size_hint)
+        n = _readinto(sock, memoryview(buf)[used:])
+        if not n:
+            return memoryview(buf)[:used]
+        used += n
+
+
+def read_http_response(sock, size_hint=HTTP_RECV_BUFFER_SIZE):
+    """流式解析HTTP/1.1响应
+
+    头部逐行读取；body 按 Content-Length 或 chunked 编码读入一次性分配的
+    bytearray(通过 readinto/memoryview)，两者都没有时读到连接关闭为止。
+    """
+    status_line = sock.readline()
+    if not status_line:
+        raise OSError("connection closed before response")
+    parts = status_line.decode().strip().split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise ValueError("invalid status line: {}".format(status_line))
+    status = int(parts[1])
+    reason = parts[2] if len(parts) > 2 else ""
+
+    headers = {}
+    while True:
+        line = sock.readline()
+        if not line or line == b"\r\n":
+            break
+        fields = line.decode().split(":", 1)
+        if len(fields) == 2:
+            headers[fields[0].strip().lower()] = fields[1].strip()
+
+    if 100 <= status < 200 or status in (204, 304):
+        body = memoryview(b"")
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        body = _read_chunked_body(sock, size_hint)
+    elif "content-length" in headers:
+        body = memoryview(bytearray(int(headers["content-length"])))
+        _read_exactly(sock, body)
+    else:
+        body = _read_body_until_close(sock, size_hint)
+    return HttpResponse(status, reason, headers, body)
+
+
+class HttpsClient(object):
+    """可复用的HTTPS客户端
+
+    对同一主机的多次请求复用一条TLS连接(keep-alive)，DNS解析结果按TTL缓存，
+    固定的请求头在构造时一次性生成。
+    """
+
+    dns_cache = {}  # (host, port) -> (addr, expire_time)
+
+    def __init__(self, host, port=443, headers=None):
+        self.host = host
+        self.port = port
+        self.__sock = None
+        static_headers = "Host: {}\r\n".format(host)
+        for key, value in (headers or ()):
+            static_headers += "{}: {}\r\n".format(key, value)
+        static_headers += "Connection: keep-alive\r\n"
+        self.static_headers = static_headers
+
+    def __str__(self):
+        return "{}(host=\"{}\")".format(type(self).__name__, self.host)
+
+    @classmethod
+    def resolve(cls, host, port):
+        import usocket
+        key = (host, port)
+        cached = cls.dns_cache.get(key)
+        now = utime.time()
+        if cached is not None and 0 <= cached[1] - now <= DNS_CACHE_TTL:
+            return cached[0]
+        addr_info = usocket.getaddrinfo(host, port)
+        if not addr_info:
+            raise Exception("DNS解析失败: {}".format(host))
+        addr = addr_info[0][-1]
+        cls.dns_cache[key] = (addr, now + DNS_CACHE_TTL)
+        return addr
+
+    def __connect(self):
+        import usocket
+        import ussl
+        addr = self.resolve(self.host, self.port)
+        logger.debug("连接地址: {}", addr)
+        sock = usocket.socket()
+        try:
+            sock.connect(addr)
+            logger.debug("TCP连接成功")
+            ssl_sock = ussl.wrap_socket(sock, server_hostname=self.host)
+        except Exception:
+            sock.close()
+            # 连接失败时丢弃DNS缓存，下次重新解析
+            self.dns_cache.pop((self.host, self.port), None)
+            raise
+        logger.debug("SSL连接成功")
+        return ssl_sock
+
+    def close(self):
+        if self.__sock is not None:
+            try:
+                self.__sock.close()
+            except Exception:
+                pass
+            self.__sock = None
+
+    def request(self, method, path, body="", content_type="application/json"):
+        """发送请求并读取完整响应，连接保持打开供下一次请求复用"""
+        if isinstance(body, str):
+            body = body.encode()
+        head = "{} {} HTTP/1.1\r\n{}Content-Type: {}\r\nContent-Length: {}\r\n\r\n".format(
+            method, path, self.static_headers, content_type, len(body)
+        ).encode()
+        while True:
+            reused = self.__sock is not None
+            if not reused:
+                self.__sock = self.__connect()
+            try:
+                self.__sock.write(head)
+                if body:
+                    self.__sock.write(body)
+                logger.debug("请求已发送")
+                response = read_http_response(self.__sock)
+            except Exception as e:
+                self.close()
+                if reused:
+                    # 复用的连接可能已被服务器关闭，新建连接重试一次
+                    logger.debug("{} 复用连接失败，重新连接: {}", self, repr(e))
+                    continue
+                raise
+            headers = response.headers
+            if headers.get("connection", "").lower() == "close" or (
+                "content-length" not in headers and headers.get("transfer-encoding", "").lower() != "chunked"
+            ):
+                self.close()
+            return response
+
+
+class OTACache(object):
+    """OTA缓存 - 将WebSocket配置、激活状态和固件信息持久化到flash"""
+
+    def __init__(self, path=OTA_CACHE_FILE, ttl=OTA_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    def load(self):
+        """读取缓存，文件不存在、损坏或版本不匹配时返回None"""
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.debug("读取OTA缓存失败: {}", repr(e))
+            return None
+        if not isinstance(data, dict) or data.get("version") != OTA_CACHE_VERSION:
+            logger.warn("OTA缓存版本不匹配，已忽略")
+            return None
+        websocket = data.get("websocket")
+        if not isinstance(websocket, dict) or "url" not in websocket or "token" not in websocket:
+            logger.warn("OTA缓存缺少WebSocket配置，已忽略")
+            return None
+        return data
+
+    def save(self, websocket, activated, firmware):
+        """先写临时文件再重命名，避免掉电导致缓存文件损坏"""
+        data = {
+            "version": OTA_CACHE_VERSION,
+            "timestamp": utime.time(),
+            "websocket": websocket,
+            "activated": activated,
+            "firmware": firmware
+        }
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            uos.rename(tmp_path, self.path)
+        except Exception as e:
+            logger.error("写入OTA缓存失败: {}", repr(e))
+            return False
+        return True
+
+    def is_expired(self, data):
+        age = utime.time() - data.get("timestamp", 0)
+        # RTC 未同步时时间可能回退，此时同样视为过期
+        return age < 0 or age >= self.ttl
+
 
 class OTAClient(object):
     """OTA客户端 - 获取WebSocket配置"""
@@ -26,7 +310,29 @@ class OTAClient(object):
         self.firmware_version = self._get_firmware_version()
         self.next_firmware_version = None
         self.next_firmware_url = None
+        self.applied_firmware_version = None  # 已下载成功的固件版本，避免重复下载同一固件
+        self.activated = False
+        self.cache = OTACache()
+        self.cache_expired = True
         self._generate_device_info()
+        url_parts = self.ota_endpoint.replace("https://", "").split("/")
+        self.ota_host = url_parts[0]
+        self.ota_path = "/" + "/".join(url_parts[1:])
+        self.http_client = HttpsClient(
+            self.ota_host,
+            headers=(
+                ("User-Agent", "SC-HEART-P1/{}".format(self.firmware_version)),
+                ("Accept-Language", "zh-CN"),
+                ("Activation-Version", "2"),
+                ("Device-Id", self.device_info.get('mac_address', '')),
+                ("Client-Id", self.device_info.get('uuid', '')),
+                ("Serial-Number", SERIAL_NUMBER),
+                ("X-Device-Type", "SC-HEART-P1"),
+                ("X-Firmware-Version", self.firmware_version),
+                ("X-Hardware-Version", "1.0"),
+                ("X-Protocol-Version", "2"),
+            )
+        )
         
     def _generate_device_info(self):
         """生成设备信息"""
@@ -35,7 +341,7 @@ class OTAClient(object):
             imei = modem.getDevImei()
             mac_address = self._imei_to_mac(imei)
         except Exception as e:
-            logger.debug("无法获取IMEI，使用随机MAC: {}".format(repr(e)))
+            logger.debug("无法获取IMEI，使用随机MAC: {}", repr(e))
             mac_address = self._generate_random_mac()
             imei = "123456789012345"
         
@@ -85,14 +391,15 @@ class OTAClient(object):
             "protocol_version": 3
         })
         
-        logger.debug("设备UUID: {}".format(device_uuid))
+        logger.debug("设备UUID: {}", device_uuid)
         logger.debug("=== 设备信息详情 ===")
-        logger.debug("MAC地址: {}".format(mac_address))
-        logger.debug("IMEI: {}".format(imei))
-        logger.debug("设备UUID: {}".format(device_uuid))
-        logger.debug("设备Hashcode: {}".format(device_hashcode))
-        logger.debug("固件版本: {}".format(self.firmware_version))
-        logger.debug("完整设备信息: {}".format(json.dumps(self.device_info)))
+        logger.debug("MAC地址: {}", mac_address)
+        logger.debug("IMEI: {}", imei)
+        logger.debug("设备UUID: {}", device_uuid)
+        logger.debug("设备Hashcode: {}", device_hashcode)
+        logger.debug("固件版本: {}", self.firmware_version)
+        if logger.isEnabledFor(Level.DEBUG):
+            logger.debug("完整设备信息: {}", json.dumps(self.device_info))
         logger.debug("=== 设备信息详情结束 ===")
     
     def _get_firmware_version(self):
@@ -101,7 +408,7 @@ class OTAClient(object):
         # 这个版本号应该与OTA服务器上的版本进行比较
         # 格式：主版本号.次版本号.修订号 (例如: 0.0.1, 1.0.0, 2.1.3)
         custom_version = "0.0.1"
-        logger.debug("使用自定义固件版本: {}".format(custom_version))
+        logger.debug("使用自定义固件版本: {}", custom_version)
         return custom_version
     
     def _imei_to_mac(self, imei):
@@ -163,7 +470,7 @@ class OTAClient(object):
                 # 如果没有hashlib，使用简单的UUID格式
                 return "xiaozhi-{}-device".format(mac_clean)
         except Exception as e:
-            logger.debug("UUID生成失败，使用备用方案: {}".format(repr(e)))
+            logger.debug("UUID生成失败，使用备用方案: {}", repr(e))
             return str(uuid.uuid4())
     
     def _generate_device_hashcode(self, imei):
@@ -194,67 +501,13 @@ class OTAClient(object):
                 return "xiaozhi_{}".format(imei[-8:] if len(imei) >= 8 else imei)
                 
         except Exception as e:
-            logger.debug("hashcode生成失败，使用简化方法: {}".format(repr(e)))
+            logger.debug("hashcode生成失败，使用简化方法: {}", repr(e))
             # 最后备用方案
             return "xiaozhi_{}".format(imei[-8:] if len(imei) >= 8 else imei)
 
-    def _http_request(self, request):
-        try:
-            import usocket
-            import ussl
-        except ImportError:
-            logger.error("QuecPython环境缺少usocket或ussl模块")
-            return False
-        
-        url_parts = self.ota_endpoint.replace("https://", "").split("/")
-        host = url_parts[0]
-        path = "/" + "/".join(url_parts[1:])
-            
-        # 创建socket连接
-        sock = usocket.socket()
-        
-        # DNS解析
-        addr_info = usocket.getaddrinfo(host, 443)
-        if not addr_info:
-            raise Exception("DNS解析失败: {}".format(host))
-        
-        addr = addr_info[0][-1]
-        logger.debug("连接地址: {}".format(addr))
-        
-        # 建立TCP连接
-        sock.connect(addr)
-        logger.debug("TCP连接成功")
-        
-        # 建立SSL连接
-        ssl_sock = ussl.wrap_socket(sock, server_hostname=host)
-        logger.debug("SSL连接成功")
-        
-        # 发送请求
-        ssl_sock.write(request.encode())
-        logger.debug("请求已发送")
-        
-        # 接收响应
-        response_data = b''
-        max_read_attempts = 50
-        read_attempts = 0
-        
-        while read_attempts < max_read_attempts:
-            try:
-                chunk = ssl_sock.read(1024)
-                if not chunk:
-                    break
-                response_data += chunk
-                read_attempts += 1
-                
-                # 检查是否收到完整响应
-                if b'\r\n\r\n' in response_data:
-                    break
-            except OSError:
-                break
-        
-        ssl_sock.close()
-        
-        return response_data
+    def _http_request(self, path, post_data):
+        return self.http_client.request("POST", path, post_data)
+
     def get_websocket_config(self):
         """从OTA API获取WebSocket配置"""
         logger.info("正在从OTA API获取WebSocket配置...")
@@ -271,8 +524,10 @@ class OTAClient(object):
                 # 设备已经注册，直接获取WebSocket配置
                 if hasattr(self, '_first_response') and self._first_response and "websocket" in self._first_response:
                     self.websocket_config = self._first_response["websocket"]
+                    self.activated = True
+                    self._save_cache()
                     logger.info("设备已注册，获取WebSocket配置成功")
-                    logger.debug("WebSocket URL: {}".format(self.websocket_config["url"]))
+                    logger.debug("WebSocket URL: {}", self.websocket_config["url"])
                     return True
                 else:
                     logger.error("设备已注册但未找到WebSocket配置")
@@ -287,114 +542,94 @@ class OTAClient(object):
             # 激活成功后，从第一步响应中获取WebSocket配置
             if hasattr(self, '_first_response') and self._first_response and "websocket" in self._first_response:
                 self.websocket_config = self._first_response["websocket"]
+                self.activated = True
+                self._save_cache()
                 logger.info("激活成功，获取WebSocket配置成功")
-                logger.debug("WebSocket URL: {}".format(self.websocket_config["url"]))
+                logger.debug("WebSocket URL: {}", self.websocket_config["url"])
                 return True
             else:
                 logger.error("激活成功但未找到WebSocket配置")
                 return False
             
         except Exception as e:
-            logger.error("获取WebSocket配置失败: {}".format(repr(e)))
+            logger.error("获取WebSocket配置失败: {}", repr(e))
             return False
+        finally:
+            self.http_client.close()
     
+    def load_cached_config(self):
+        """从flash缓存恢复WebSocket配置，成功返回True"""
+        data = self.cache.load()
+        if data is None:
+            return False
+        self.websocket_config = data["websocket"]
+        self.activated = data.get("activated", False)
+        firmware = data.get("firmware") or {}
+        self.next_firmware_version = firmware.get("version")
+        self.next_firmware_url = firmware.get("url")
+        self.applied_firmware_version = firmware.get("applied")
+        self.cache_expired = self.cache.is_expired(data)
+        logger.info("已加载OTA缓存，是否过期: {}", self.cache_expired)
+        return True
+
+    def _save_cache(self):
+        if self.cache.save(
+            self.websocket_config,
+            self.activated,
+            {"version": self.next_firmware_version, "url": self.next_firmware_url, "applied": self.applied_firmware_version}
+        ):
+            self.cache_expired = False
+
     def _get_challenge(self):
         """第一步：获取challenge"""
         logger.info("正在获取challenge...")
         
         try:
-            # 解析URL
-            url_parts = self.ota_endpoint.replace("https://", "").split("/")
-            host = url_parts[0]
-            path = "/" + "/".join(url_parts[1:])
+            host = self.ota_host
+            path = self.ota_path
             
             # 构建请求数据 - 使用完整的设备信息
             request_data = self.device_info
             
             post_data = json.dumps(request_data)
             
-            # 构建HTTP请求头
-            mac_address = self.device_info.get('mac_address', '')
-            device_uuid = self.device_info.get('uuid', '')
-            serial_number = "JJZL_SILICORE_1_FCFCB75053D9870E"
-            
-            request = "POST {} HTTP/1.1\r\n".format(path)
-            request += "Host: {}\r\n".format(host)
-            request += "Content-Type: application/json\r\n"
-            request += "Content-Length: {}\r\n".format(len(post_data))
-            request += "Connection: close\r\n"
-            request += "User-Agent: SC-HEART-P1/{}\r\n".format(self.firmware_version)
-            request += "Accept-Language: zh-CN\r\n"
-            request += "Activation-Version: 2\r\n"
-            request += "Device-Id: {}\r\n".format(mac_address)
-            request += "Client-Id: {}\r\n".format(device_uuid)
-            request += "Serial-Number: {}\r\n".format(serial_number)
-            request += "X-Device-Type: SC-HEART-P1\r\n"
-            request += "X-Firmware-Version: {}\r\n".format(self.firmware_version)
-            request += "X-Hardware-Version: 1.0\r\n"
-            request += "X-Protocol-Version: 2\r\n"
-            request += "\r\n"
-            request += post_data
-            
             # 打印完整的HTTP请求信息用于调试
             logger.debug("=== 第一步：获取Challenge HTTP请求详情 ===")
-            logger.debug("请求URL: https://{}{}".format(host, path))
+            logger.debug("请求URL: https://{}{}", host, path)
             logger.debug("请求方法: POST")
             logger.debug("请求头:")
-            logger.debug("  Host: {}".format(host))
-            logger.debug("  Content-Type: application/json")
-            logger.debug("  Content-Length: {}".format(len(post_data)))
-            logger.debug("  Connection: close")
-            logger.debug("  User-Agent: SC-HEART-P1/{}".format(self.firmware_version))
-            logger.debug("  Accept-Language: zh-CN")
-            logger.debug("  Activation-Version: 2")
-            logger.debug("  Device-Id: {}".format(mac_address))
-            logger.debug("  Client-Id: {}".format(device_uuid))
-            logger.debug("  Serial-Number: {}".format(serial_number))
-            logger.debug("  X-Device-Type: SC-HEART-P1")
-            logger.debug("  X-Firmware-Version: {}".format(self.firmware_version))
-            logger.debug("  X-Hardware-Version: 1.0")
-            logger.debug("  X-Protocol-Version: 2")
+            logger.debug("{}", self.http_client.static_headers)
             logger.debug("请求体:")
-            logger.debug("{}".format(post_data))
-            logger.debug("=== 完整HTTP请求 ===")
-            logger.debug("{}".format(request))
+            logger.debug("{}", post_data)
             logger.debug("=== 第一步请求详情结束 ===")
             
-            response_data = self._http_request(request=request)
+            response = self._http_request(path, post_data)
             # 解析响应
-            response_str = response_data.decode('utf-8')
-            logger.debug("收到响应: {} bytes".format(len(response_data)))
-            
-            # 分离头部和主体
-            if '\r\n\r\n' not in response_str:
-                raise Exception("响应格式错误")
-            
-            headers, body = response_str.split('\r\n\r\n', 1)
+            body = response.text()
+            logger.debug("收到响应: {} {}, {} bytes", response.status, response.reason, len(response.body))
             
             # 打印响应详情
             logger.debug("=== 第一步响应详情 ===")
             logger.debug("响应头:")
-            logger.debug("{}".format(headers))
+            logger.debug("{}", response.headers)
             logger.debug("响应体:")
-            logger.debug("{}".format(body))
+            logger.debug("{}", body)
             logger.debug("=== 第一步响应详情结束 ===")
             
             # 检查状态码
-            lines = headers.split('\r\n')
-            status_line = lines[0] if lines else ""
+            status_line = "{} {}".format(response.status, response.reason)
             
-            if 'HTTP/1.1 202' in status_line:
+            if response.status == 202:
                 logger.warn("第一步请求被接受但需要等待处理")
                 return None
-            elif 'HTTP/1.1 200' not in status_line:
-                logger.error("HTTP错误状态码: {}".format(status_line))
+            elif response.status != 200:
+                logger.error("HTTP错误状态码: {}", status_line)
                 raise Exception("HTTP错误: {}".format(status_line))
             
             # 解析JSON响应
             response_data = json.loads(body)
             logger.debug("JSON解析成功")
-            logger.debug("第一步API响应: {}".format(response_data))
+            logger.debug("第一步API响应: {}", response_data)
             
             # 保存第一步响应，以便后续使用
             self._first_response = response_data
@@ -404,40 +639,36 @@ class OTAClient(object):
                 logger.info("设备已经注册，直接获取WebSocket配置")
                 self.next_firmware_version = response_data["firmware"].get("version")
                 self.next_firmware_url = response_data["firmware"].get("url")
-                logger.info("下一版本固件信息: {}:{}".format(self.next_firmware_version, self.next_firmware_url))
+                logger.info("下一版本固件信息: {}:{}", self.next_firmware_version, self.next_firmware_url)
                 return "ALREADY_REGISTERED"
             
             # 提取challenge
             if "challenge" in response_data:
                 challenge = response_data["challenge"]
-                logger.info("成功获取challenge: {}".format(challenge))
+                logger.info("成功获取challenge: {}", challenge)
                 return challenge
             elif "activation" in response_data and "challenge" in response_data["activation"]:
                 challenge = response_data["activation"]["challenge"]
-                logger.info("成功获取challenge: {}".format(challenge))
+                logger.info("成功获取challenge: {}", challenge)
                 return challenge
             else:
                 logger.error("响应中没有challenge字段")
-                logger.debug("可用的字段: {}".format(list(response_data.keys())))
+                logger.debug("可用的字段: {}", list(response_data.keys()))
                 if "activation" in response_data:
-                    logger.debug("activation字段内容: {}".format(response_data["activation"]))
+                    logger.debug("activation字段内容: {}", response_data["activation"])
                 return None
                 
         except Exception as e:
-            logger.error("获取challenge失败: {}".format(repr(e)))
+            logger.error("获取challenge失败: {}", repr(e))
             return None
     
     def _activate_device(self, challenge):
         """第二步：激活设备"""
         try:
-            import usocket
-            import ussl
             import uhashlib as hashlib
             import ubinascii
         except ImportError:
             try:
-                import usocket
-                import ussl
                 import hashlib
                 import binascii as ubinascii
             except ImportError:
@@ -447,18 +678,15 @@ class OTAClient(object):
         logger.info("正在激活设备...")
         
         try:
-            # 解析URL
-            url_parts = self.ota_endpoint.replace("https://", "").split("/")
-            host = url_parts[0]
+            host = self.ota_host
             # 确保路径正确，不要重复xiaozhi
-            if len(url_parts) > 1 and url_parts[1] == "xiaozhi":
+            if self.ota_path.startswith("/xiaozhi/"):
                 path = "/xiaozhi/ota/activate"
             else:
-                path = "/" + "/".join(url_parts[1:]) + "/activate"
+                path = self.ota_path + "/activate"
             
             # 生成HMAC
-            mac_address = self.device_info.get('mac_address', '')
-            serial_number = "JJZL_SILICORE_1_FCFCB75053D9870E"
+            serial_number = SERIAL_NUMBER
             
             # 使用正确的license_key
             license_key = "qOUuIWRUrvn80gsDZFUDC6Jd2yeLw5sP"
@@ -471,7 +699,7 @@ class OTAClient(object):
                 hmac_result = ubinascii.hexlify(hmac_instance.digest()).decode()
             except Exception as e:
                 # 如果hmac模块不可用，手动实现HMAC-SHA256
-                logger.debug("hmac模块不可用，手动实现HMAC: {}".format(repr(e)))
+                logger.debug("hmac模块不可用，手动实现HMAC: {}", repr(e))
                 
                 # 手动实现HMAC-SHA256
                 key = license_key.encode()
@@ -504,9 +732,9 @@ class OTAClient(object):
                 hmac_result = ubinascii.hexlify(outer_digest).decode()
             
             logger.debug("HMAC计算详情:")
-            logger.debug("  license_key: {}".format(license_key))
-            logger.debug("  challenge: {}".format(challenge))
-            logger.debug("  hmac_result: {}".format(hmac_result))
+            logger.debug("  license_key: {}", license_key)
+            logger.debug("  challenge: {}", challenge)
+            logger.debug("  hmac_result: {}", hmac_result)
             
             # 构建请求数据
             request_data = {
@@ -518,90 +746,47 @@ class OTAClient(object):
             
             post_data = json.dumps(request_data)
             
-            # 构建HTTP请求头
-            device_uuid = self.device_info.get('uuid', '')
-            
-            request = "POST {} HTTP/1.1\r\n".format(path)
-            request += "Host: {}\r\n".format(host)
-            request += "Content-Type: application/json\r\n"
-            request += "Content-Length: {}\r\n".format(len(post_data))
-            request += "Connection: close\r\n"
-            request += "User-Agent: SC-HEART-P1/{}\r\n".format(self.firmware_version)
-            request += "Accept-Language: zh-CN\r\n"
-            request += "Activation-Version: 2\r\n"
-            request += "Device-Id: {}\r\n".format(mac_address)
-            request += "Client-Id: {}\r\n".format(device_uuid)
-            request += "Serial-Number: {}\r\n".format(serial_number)
-            request += "X-Device-Type: SC-HEART-P1\r\n"
-            request += "X-Firmware-Version: {}\r\n".format(self.firmware_version)
-            request += "X-Hardware-Version: 1.0\r\n"
-            request += "X-Protocol-Version: 2\r\n"
-            request += "\r\n"
-            request += post_data
-            
             # 打印完整的HTTP请求信息用于调试
             logger.debug("=== 第二步：激活设备 HTTP请求详情 ===")
-            logger.debug("请求URL: https://{}{}".format(host, path))
+            logger.debug("请求URL: https://{}{}", host, path)
             logger.debug("请求方法: POST")
             logger.debug("请求头:")
-            logger.debug("  Host: {}".format(host))
-            logger.debug("  Content-Type: application/json")
-            logger.debug("  Content-Length: {}".format(len(post_data)))
-            logger.debug("  Connection: close")
-            logger.debug("  User-Agent: SC-HEART-P1/{}".format(self.firmware_version))
-            logger.debug("  Accept-Language: zh-CN")
-            logger.debug("  Activation-Version: 2")
-            logger.debug("  Device-Id: {}".format(mac_address))
-            logger.debug("  Client-Id: {}".format(device_uuid))
-            logger.debug("  Serial-Number: {}".format(serial_number))
-            logger.debug("  X-Device-Type: SC-HEART-P1")
-            logger.debug("  X-Firmware-Version: {}".format(self.firmware_version))
-            logger.debug("  X-Hardware-Version: 1.0")
-            logger.debug("  X-Protocol-Version: 2")
+            logger.debug("{}", self.http_client.static_headers)
             logger.debug("请求体:")
-            logger.debug("{}".format(post_data))
-            logger.debug("=== 完整HTTP请求 ===")
-            logger.debug("{}".format(request))
+            logger.debug("{}", post_data)
             logger.debug("=== 第二步请求详情结束 ===")
             
-            response_data = self._http_request(request=request)
+            response = self._http_request(path, post_data)
             # 解析响应
-            response_str = response_data.decode('utf-8')
-            logger.debug("收到响应: {} bytes".format(len(response_data)))
-            
-            # 分离头部和主体
-            if '\r\n\r\n' not in response_str:
-                raise Exception("响应格式错误")
-            
-            headers, body = response_str.split('\r\n\r\n', 1)
+            body = response.text()
+            logger.debug("收到响应: {} {}, {} bytes", response.status, response.reason, len(response.body))
             
             # 打印响应详情
             logger.debug("=== 第二步响应详情 ===")
             logger.debug("响应头:")
-            logger.debug("{}".format(headers))
+            logger.debug("{}", response.headers)
             logger.debug("响应体:")
-            logger.debug("{}".format(body))
+            logger.debug("{}", body)
             logger.debug("=== 第二步响应详情结束 ===")
             
             # 检查状态码
-            lines = headers.split('\r\n')
-            status_line = lines[0] if lines else ""
+            status_line = "{} {}".format(response.status, response.reason)
             
-            if 'HTTP/1.1 202' in status_line:
+            if response.status == 202:
                 logger.warn("激活请求被接受但需要等待处理")
                 # 202状态码表示请求被接受，但需要等待处理
                 # 根据参考代码，这应该返回ESP_ERR_TIMEOUT，但我们在这里返回True
                 # 因为服务器已经接受了我们的激活请求
                 logger.info("设备激活请求已被服务器接受")
                 return True
-            elif 'HTTP/1.1 200' not in status_line:
-                logger.error("HTTP错误状态码: {}".format(status_line))
+            elif response.status != 200:
+                logger.error("HTTP错误状态码: {}", status_line)
                 raise Exception("HTTP错误: {}".format(status_line))
             
             # 解析JSON响应
             response_data = json.loads(body)
             logger.debug("JSON解析成功")
-            logger.debug("第二步API响应: {}".format(response_data))
+            logger.debug("第二步API响应: {}", response_data)
             
             # 激活成功，不需要从第二步响应中提取WebSocket配置
             # WebSocket配置已经在第一步响应中获取
@@ -609,10 +794,8 @@ class OTAClient(object):
             return True
 
         except Exception as e:
-            logger.error("激活设备失败: {}".format(repr(e)))
+            logger.error("激活设备失败: {}", repr(e))
             return False
-    def _activate_device(self, challenge):
-        " "
     def get_websocket_url(self):
         """获取WebSocket URL"""
         if self.websocket_config:
@@ -632,8 +815,11 @@ class OTAClient(object):
         if not self.next_firmware_version or not self.next_firmware_url:
             logger.info("没有可用的固件更新")
             return False
-        logger.info("检测到新固件版本: {}，下载链接: {}".format(
-            self.next_firmware_version, OTA_DOWNLOAD_URL + self.next_firmware_version + "/dfota_1.bin"))
+        if self.next_firmware_version == self.applied_firmware_version:
+            logger.info("固件 {} 已下载过，跳过", self.next_firmware_version)
+            return False
+        logger.info("检测到新固件版本: {}，下载链接: {}",
+                    self.next_firmware_version, OTA_DOWNLOAD_URL + self.next_firmware_version + "/dfota_1.bin")
         try:
             import fota
             import utime
@@ -642,15 +828,25 @@ class OTAClient(object):
             # 由于小智只能下载一个包 所以先暂时放到这里
             res = fota_obj.httpDownload(url1=OTA_DOWNLOAD_URL + self.next_firmware_version + "/dfota_1.bin", url2=OTA_DOWNLOAD_URL + self.next_firmware_version + "/dfota_2.bin")
             if res != 0:
-                logger.error("固件更新失败，返回码: {}".format(res))
+                logger.error("固件更新失败，返回码: {}", res)
                 return None
+            self.applied_firmware_version = self.next_firmware_version
+            self._save_cache()
             logger.info("固件更新成功")
             utime.sleep(2)
     
         except Exception as e:
-            logger.error("固件下载失败: {}".format(repr(e)))
+            logger.error("固件下载失败: {}", repr(e))
             return None
 
+def _is_text_frame(raw):
+    """按帧类型分流: uwebsocket 对文本帧(opcode 0x1)返回 str，对二进制帧(opcode 0x2)返回 bytes；
+    若传输层统一返回 bytes，则退化为检查首字节是否为 '{'，只有控制消息才需要做JSON解析"""
+    if isinstance(raw, str):
+        return True
+    return len(raw) > 0 and raw[0] == 0x7B
+
+
 class JsonMessage(object):
 
     def __init__(self, kwargs):
@@ -670,57 +866,269 @@ class JsonMessage(object):
         return self.kwargs[key]
 
 
-class RespHelper(Condition):
+class PendingResponse(Future):
+    """等待响应的请求
 
-    def __init__(self):
-        self.__ack_items = {}
+    本身是以响应消息为结果的 Future: 可阻塞等待 get() / get_or_none()，也可通过 callback / add_done_callback /
+    then 非阻塞地组合后续处理。超时的请求以 None 完成(expired=True)，回调在完成它的线程中执行:
+    收到响应时为接收线程，超时时为定时器线程。
+    """
+
+    def __init__(self, helper, key, timeout=None, callback=None):
         super().__init__()
+        self.key = key
+        self.timeout_ms = None if timeout is None else int(timeout * 1000)
+        self.deadline = None if timeout is None else utime.ticks_add(utime.ticks_ms(), self.timeout_ms)
+        self.response = None
+        self.expired = False
+        self.__helper = helper
+        self.__callback = callback
+        if callback is not None:
+            self.add_done_callback(self.__on_done)
+
+    def __str__(self):
+        return "<PendingResponse {}>".format(self.key)
+
+    def get_or_none(self, timeout=None):
+        """block until response arrived or deadline reached, return response or None
+
+        unlike get(), never raises: a timeout withdraws the request and returns None
+        """
+        if timeout is None and self.deadline is not None:
+            timeout = utime.ticks_diff(self.deadline, utime.ticks_ms()) / 1000
+        try:
+            if timeout is None or timeout > 0:
+                return super().get(timeout=timeout)
+            return super().get(block=False)
+        except (self.TimeoutError, self.NotReadyError):
+            pass
+        except self.CancelledError:
+            return None
+        if self.__helper.cancel(self):
+            self._finish(None, expired=True)
+            return None
+        # 超时的同时响应已被取走，正在完成中
+        try:
+            return super().get()
+        except self.CancelledError:
+            return None
+
+    def cancel(self):
+        """withdraw the request, the response (if any) will be dropped"""
+        if not self.__helper.cancel(self):
+            return False
+        return super().cancel()
+
+    def _finish(self, response, expired=False):
+        self.response = response
+        self.expired = expired
+        self.set(rv=response)
+
+    def __on_done(self, _):
+        try:
+            self.__callback(self.response)
+        except Exception as e:
+            logger.error("{} callback failed, Exception details: {}", self, repr(e))
+
+
+class RespHelper(object):
+    """请求/响应关联表
+
+    以 (type, session_id) 为键登记等待中的请求；session_id 为空的请求可匹配任意会话的响应。
+    相同超时时间的请求按登记顺序排在同一个到期队列中，队首即最早到期者，
+    因此过期清理只需检查各队列队首，每个条目 O(1) 移除。
+    一个定时器始终对准最早的到期时刻，只注册回调、链路上没有任何消息的请求也会按时超时。
+    发送请求时不持有本表的锁，多种控制消息可以并发进行。
+    """
+
+    def __init__(self):
+        self.__lock = Lock("resp_helper")
+        self.__pending = {}  # (type, session_id) -> [PendingResponse, ...]
+        self.__expiry_queues = {}  # timeout_ms -> [PendingResponse, ...] 按到期时间排序
+        self.__expiry_timer = Timer(self.expire)
+        self.__timer_deadline = None  # 定时器当前对准的到期时刻
+
+    @staticmethod
+    def make_key(msg):
+        return msg["type"], msg.kwargs.get("session_id") or None
+
+    def register(self, request, timeout=None, callback=None):
+        """register a request before sending it, return a PendingResponse"""
+        pending = PendingResponse(self, self.make_key(request), timeout=timeout, callback=callback)
+        with self.__lock:
+            expired = self.__collect_expired()
+            self.__pending.setdefault(pending.key, []).append(pending)
+            if pending.timeout_ms is not None:
+                self.__expiry_queues.setdefault(pending.timeout_ms, []).append(pending)
+                if self.__timer_deadline is None or utime.ticks_diff(pending.deadline, self.__timer_deadline) < 0:
+                    self.__arm(pending.deadline)
+        self.__finish_all(expired, None, True)
+        return pending
 
     def get(self, request, timeout=None):
         """accept a request and return response matched or none"""
-        self.__ack_items[request] = None
-        self.wait_for(lambda: self.__ack_items[request] is not None, timeout=timeout)
-        return self.__ack_items.pop(request)
+        return self.register(request, timeout=timeout).get_or_none()
 
     def put(self, response):
-        """accept a response and match it with request if possible"""
-        for request in self.__ack_items.keys():
-            if not self.validate(request, response):
-                continue
-            self.__ack_items[request] = response
-            self.notify_all()
-            break
+        """accept a response and match it with request if possible, return True if matched"""
+        msg_type, session_id = self.make_key(response)
+        with self.__lock:
+            expired = self.__collect_expired()
+            pending = self.__pop_pending((msg_type, session_id))
+            if pending is None and session_id is not None:
+                pending = self.__pop_pending((msg_type, None))
+        self.__finish_all(expired, None, True)
+        if pending is None:
+            return False
+        pending._finish(response)
+        return True
+
+    def cancel(self, pending):
+        """withdraw a pending request, return False if it was already answered or expired"""
+        with self.__lock:
+            return self.__remove_pending(pending)
+
+    def expire(self):
+        """finish all requests whose deadline has passed, called by the expiry timer"""
+        with self.__lock:
+            expired = self.__collect_expired()
+            self.__timer_deadline = None
+            for queue in self.__expiry_queues.values():
+                deadline = queue[0].deadline
+                if self.__timer_deadline is None or utime.ticks_diff(deadline, self.__timer_deadline) < 0:
+                    self.__timer_deadline = deadline
+            if self.__timer_deadline is not None:
+                self.__arm(self.__timer_deadline)
+        self.__finish_all(expired, None, True)
+
+    def __arm(self, deadline):
+        self.__timer_deadline = deadline
+        self.__expiry_timer.start(max(0, utime.ticks_diff(deadline, utime.ticks_ms())) / 1000)
+
+    def __pop_pending(self, key):
+        items = self.__pending.get(key)
+        if not items:
+            return None
+        pending = items.pop(0)
+        if not items:
+            del self.__pending[key]
+        return pending
+
+    def __remove_pending(self, pending):
+        items = self.__pending.get(pending.key)
+        if items is None:
+            return False
+        try:
+            items.remove(pending)
+        except ValueError:
+            return False
+        if not items:
+            del self.__pending[pending.key]
+        return True
+
+    def __collect_expired(self):
+        expired = []
+        now = utime.ticks_ms()
+        for timeout_ms in list(self.__expiry_queues.keys()):
+            queue = self.__expiry_queues[timeout_ms]
+            while queue and (queue[0].done() or utime.ticks_diff(queue[0].deadline, now) <= 0):
+                pending = queue.pop(0)
+                if not pending.done() and self.__remove_pending(pending):
+                    expired.append(pending)
+            if not queue:
+                del self.__expiry_queues[timeout_ms]
+        return expired
 
     @staticmethod
-    def validate(request, response):
-        return request["type"] == response["type"]
+    def __finish_all(items, response, expired):
+        for pending in items:
+            pending._finish(response, expired=expired)
 
 
 class WebSocketClient(object):
 
-    def __init__(self, debug=WSS_DEBUG):
+    def __init__(self, debug=WSS_DEBUG, protocol_version=PROTOCOL_VERSION):
         self.debug = debug
         self.ota_client = OTAClient()
         self.host = None
         self.access_token = None
+        self.protocol_version = int(protocol_version)
+        if self.protocol_version not in SUPPORTED_PROTOCOL_VERSIONS:
+            raise ValueError("unsupported protocol version: {}".format(protocol_version))
+        self.__version = self.protocol_version  # 与服务器协商后实际使用的版本
+        self.__session_ticks = utime.ticks_ms()
+        self.__tx_buffer = bytearray(BINARY_HEADER_V2_SIZE + MAX_AUDIO_PAYLOAD)
+        self.__tx_view = memoryview(self.__tx_buffer)
+        self.__min_transit = None
+        self.downlink_frames = 0
+        self.downlink_delay = 0  # ms, 相对本会话最快一帧的单向排队时延
+        self.downlink_max_delay = 0
         self.__resp_helper = RespHelper()
+        self.__send_lock = Lock("ws_send")
         self.__recv_thread = None
         self.__audio_message_handler = None
         self.__json_message_handler = None
+        self.__refresh_lock = Lock()
+        self.__refreshing = False
+        self.__firmware_pending = False  # 配置中的固件信息尚未检查
         
         # 初始化时获取配置
         self._initialize_config()
     
     def _initialize_config(self):
-        """初始化WebSocket配置"""
+        """初始化WebSocket配置
+
+        优先使用flash中缓存的配置，使设备无需等待OTA请求即可工作；
+        每次启动都在后台线程刷新，刷新失败则继续使用缓存的配置。
+        固件检查会下载固件，不在刷新线程中进行，由应用在没有会话时调用 check_firmware_update。
+        """
+        if self.ota_client.load_cached_config():
+            self.host = self.ota_client.get_websocket_url()
+            self.access_token = self.ota_client.get_access_token()
+            self.__firmware_pending = True
+            logger.info("使用缓存的WebSocket配置")
+            self.refresh_config()
+            return
         if self.ota_client.get_websocket_config():
             self.host = self.ota_client.get_websocket_url()
             self.access_token = self.ota_client.get_access_token()
-            self.ota_client.check_firmware_update()
+            self.__firmware_pending = True
             logger.info("WebSocket配置初始化成功")
         else:
             logger.error("WebSocket配置初始化失败")
             raise RuntimeError("无法获取WebSocket配置")
+
+    def refresh_config(self):
+        """在后台线程刷新OTA配置(正在刷新时直接返回)，新配置在下一次连接时生效"""
+        with self.__refresh_lock:
+            if self.__refreshing:
+                return
+            self.__refreshing = True
+        try:
+            Thread(target=self.__refresh_config_worker, name="ota_refresh").start()
+        except Exception:
+            self.__refreshing = False
+            raise
+
+    def __refresh_config_worker(self):
+        logger.info("后台刷新WebSocket配置...")
+        try:
+            if not self.ota_client.get_websocket_config():
+                logger.warn("后台刷新WebSocket配置失败，继续使用缓存配置")
+                return
+            self.host = self.ota_client.get_websocket_url()
+            self.access_token = self.ota_client.get_access_token()
+            self.__firmware_pending = True
+            logger.info("后台刷新WebSocket配置成功")
+        finally:
+            self.__refreshing = False
+
+    def check_firmware_update(self):
+        """检查(并下载)配置中的新固件，只应在没有进行中的会话时调用"""
+        if not self.__firmware_pending:
+            return False
+        self.__firmware_pending = False
+        return self.ota_client.check_firmware_update()
     
     def __str__(self):
         return "{}(host=\"{}\")".format(type(self).__name__, self.host)
@@ -760,6 +1168,23 @@ class WebSocketClient(object):
 
     def is_state_ok(self):
         return self.cli.sock.getsocketsta() == 4
+
+    def is_connected(self):
+        if getattr(self, "__client__", None) is None:
+            return False
+        try:
+            return self.is_state_ok()
+        except Exception:
+            return False
+
+    def ping(self):
+        """send websocket ping frame, return False if transport not support"""
+        write_frame = getattr(self.cli, "write_frame", None)
+        if write_frame is None:
+            return False
+        with self.__send_lock:
+            write_frame(WS_OPCODE_PING, b"")
+        return True
     
     def disconnect(self):
         """disconnect websocket"""
@@ -776,49 +1201,96 @@ class WebSocketClient(object):
         if not self.host or not self.access_token:
             raise RuntimeError("WebSocket配置未初始化")
             
-        __client__ = ws.Client.connect(
-            self.host, 
-            headers={
-                "Authorization": "Bearer {}".format(self.access_token),
-                "Protocol-Version": PROTOCOL_VERSION,
-                "Device-Id": self.get_mac_address(),
-                "Client-Id": self.generate_uuid()
-            }, 
-            debug=self.debug
-        )
+        headers = {
+            "Authorization": "Bearer {}".format(self.access_token),
+            "Protocol-Version": str(self.protocol_version),
+            "Device-Id": self.get_mac_address(),
+            "Client-Id": self.generate_uuid()
+        }
+        try:
+            __client__ = ws.Client.connect(self.host, headers=headers, debug=self.debug)
+        except Exception as e:
+            # 缓存的地址或令牌可能已失效(如被服务器拒绝)，后台重新获取配置
+            logger.warn("{} connect failed, refresh config, Exception details: {}", self, repr(e))
+            self.refresh_config()
+            raise
 
+        self.__version = self.protocol_version
         try:
-            self.__recv_thread = Thread(target=self.__recv_thread_worker)
+            self.__recv_thread = Thread(target=self.__recv_thread_worker, args=(__client__, ), name="ws_recv")
             self.__recv_thread.start(stack_size=64)
         except Exception as e:
             __client__.close()
-            logger.error("{} connect failed, Exception details: {}".format(self, repr(e)))
+            logger.error("{} connect failed, Exception details: {}", self, repr(e))
         else:
             setattr(self, "__client__", __client__)
             return __client__
 
-    def __recv_thread_worker(self):
+    def __recv_thread_worker(self, cli):
+        # 接收线程只服务于启动它的连接: 直接持有该连接，不必等 __client__ 赋值，也省去每帧的 cli 属性查找
         while True:
             try:
-                raw = self.recv()
+                raw = cli.recv()
             except Exception as e:
-                logger.info("{} recv thread break, Exception details: {}".format(self, repr(e)))
+                logger.info("{} recv thread break, Exception details: {}", self, repr(e))
                 break
             
             if raw is None or raw == "":
-                logger.info("{} recv thread break, Exception details: read none bytes, websocket disconnect".format(self))
+                logger.info("{} recv thread break, Exception details: read none bytes, websocket disconnect", self)
                 break
+            frame_logger.debug("recv data: {} bytes", len(raw))
             
+            if not _is_text_frame(raw):
+                if self.__version == 1:
+                    self.__handle_audio_message(raw)
+                else:
+                    self.__handle_binary_frame(raw)
+                continue
+
             try:
                 m = JsonMessage.from_bytes(raw)
             except Exception as e:
+                # 首字节恰好为 '{' 的二进制音频帧
                 self.__handle_audio_message(raw)
             else:
-                if m["type"] == "hello":
-                    with self.__resp_helper:
-                        self.__resp_helper.put(m)
-                else:
-                    self.__handle_json_message(m)
+                self.__dispatch_json_message(m)
+
+    def __dispatch_json_message(self, m):
+        if not self.__resp_helper.put(m) and m["type"] != "hello":
+            self.__handle_json_message(m)
+
+    def __handle_binary_frame(self, raw):
+        try:
+            if self.__version == 2:
+                _, frame_type, _, timestamp, size = ustruct.unpack_from(BINARY_HEADER_V2, raw, 0)
+                offset = BINARY_HEADER_V2_SIZE
+                self.__track_downlink_delay(timestamp)
+            else:
+                frame_type, _, size = ustruct.unpack_from(BINARY_HEADER_V3, raw, 0)
+                offset = BINARY_HEADER_V3_SIZE
+        except Exception as e:
+            logger.debug("{} invalid binary frame, Exception details: {}", self, repr(e))
+            return
+        payload = memoryview(raw)[offset:offset + size]
+        if frame_type == BINARY_TYPE_OPUS:
+            self.__handle_audio_message(payload)
+        elif frame_type == BINARY_TYPE_JSON:
+            try:
+                m = JsonMessage.from_bytes(bytes(payload))
+            except Exception as e:
+                logger.debug("{} invalid json frame, Exception details: {}", self, repr(e))
+            else:
+                self.__dispatch_json_message(m)
+
+    def __track_downlink_delay(self, timestamp):
+        # 两端时钟未同步，以本会话中传输耗时最短的一帧为基准，得到每帧的相对单向时延
+        transit = utime.ticks_diff(utime.ticks_ms(), timestamp)
+        if self.__min_transit is None or transit < self.__min_transit:
+            self.__min_transit = transit
+        self.downlink_delay = transit - self.__min_transit
+        if self.downlink_delay > self.downlink_max_delay:
+            self.downlink_max_delay = self.downlink_delay
+        self.downlink_frames += 1
 
     def __handle_audio_message(self, raw):
         if self.__audio_message_handler is None:
@@ -827,7 +1299,7 @@ class WebSocketClient(object):
         try:
             self.__audio_message_handler(raw)
         except Exception as e:
-            logger.error("{} handle audio message failed, Exception details: {}".format(self, repr(e)))
+            logger.error("{} handle audio message failed, Exception details: {}", self, repr(e))
     
     def __handle_json_message(self, msg):
         if self.__json_message_handler is None:
@@ -836,101 +1308,429 @@ class WebSocketClient(object):
         try:
             self.__json_message_handler(msg)
         except Exception as e:
-            logger.debug("{} handle json message failed, Exception details: {}".format(self, repr(e)))
+            logger.debug("{} handle json message failed, Exception details: {}", self, repr(e))
             
     def send(self, data):
-        """send data to server"""
-        # logger.debug("send data: ", data)
-        self.cli.send(data)
+        """send data to server, frames from different threads never interleave"""
+        frame_logger.debug("send data: {} bytes", len(data))
+        with self.__send_lock:
+            self.cli.send(data)
+
+    def send_audio(self, data, capture_ticks=None):
+        """send opus frame, wrapped with binary header when protocol version >= 2
+
+        header is packed into a preallocated buffer; only one sender thread may call this.
+        """
+        if self.__version == 1:
+            return self.send(data)
+        size = len(data)
+        if size > MAX_AUDIO_PAYLOAD:
+            raise ValueError("audio payload too large: {}".format(size))
+        if self.__version == 2:
+            if capture_ticks is None:
+                capture_ticks = utime.ticks_ms()
+            timestamp = utime.ticks_diff(capture_ticks, self.__session_ticks) & 0xFFFFFFFF
+            ustruct.pack_into(BINARY_HEADER_V2, self.__tx_buffer, 0, 2, BINARY_TYPE_OPUS, 0, timestamp, size)
+            end = BINARY_HEADER_V2_SIZE + size
+            self.__tx_view[BINARY_HEADER_V2_SIZE:end] = data
+        else:
+            ustruct.pack_into(BINARY_HEADER_V3, self.__tx_buffer, 0, BINARY_TYPE_OPUS, 0, size)
+            end = BINARY_HEADER_V3_SIZE + size
+            self.__tx_view[BINARY_HEADER_V3_SIZE:end] = data
+        return self.__send_binary(self.__tx_view[:end])
+
+    def __send_binary(self, data):
+        """send a binary frame straight from a buffer view, copying to bytes only if the transport needs it"""
+        frame_logger.debug("send data: {} bytes", len(data))
+        write_frame = getattr(self.cli, "write_frame", None)
+        with self.__send_lock:
+            if write_frame is None:
+                self.cli.send(bytes(data))
+            else:
+                write_frame(WS_OPCODE_BINARY, data)
+
+    @property
+    def negotiated_version(self):
+        return self.__version
+
+    def __on_hello_response(self, resp):
+        self.__min_transit = None
+        self.downlink_frames = 0
+        self.downlink_delay = 0
+        self.downlink_max_delay = 0
+        if resp is None:
+            return
+        version = resp.kwargs.get("version", 1)
+        if version not in SUPPORTED_PROTOCOL_VERSIONS or version > self.protocol_version:
+            version = 1
+        if version != self.__version:
+            logger.info("{} protocol version negotiated: {} -> {}", self, self.__version, version)
+        self.__version = version
 
     def recv(self):
         """receive data from server, return None or "" means disconnection"""
         data = self.cli.recv()
-        # logger.debug("recv data: ", data)
+        if data:
+            frame_logger.debug("recv data: {} bytes", len(data))
         return data
 
-    def hello(self):
+    def hello_async(self, sample_rate=16000, frame_duration=60, timeout=10, callback=None):
+        """send hello without blocking, return PendingResponse (a Future of the response)"""
         req = JsonMessage(
             {
                 "type": "hello",
-                "version": 1,
+                "version": self.protocol_version,
                 "transport": "websocket",
                 "audio_params": {
                     "format": "opus",
-                    "sample_rate": 16000,
+                    "sample_rate": sample_rate,
                     "channels": 1,
-                    "frame_duration": 100
+                    "frame_duration": frame_duration
                 },
                 "features": {
                     "consistent_sample_rate": True
                 }
             }
         )
-        with self.__resp_helper:
+        def on_hello_response(resp):
+            self.__on_hello_response(resp)
+            if callback is not None:
+                callback(resp)
+
+        pending = self.__resp_helper.register(req, timeout=timeout, callback=on_hello_response)
+        self.__session_ticks = utime.ticks_ms()
+        try:
             self.send(req.to_bytes())
-            resp = self.__resp_helper.get(req, timeout=10)
-            # {'transport': 'websocket', 'type': 'hello', 'session_id': 'd2091edb', 'audio_params': {'frame_duration': 60, 'channels': 1, 'format': 'opus', 'sample_rate': 24000}, 'version': 1}
-            # logger.debug("hello resp: ", resp)
-            return resp
+        except Exception:
+            self.__resp_helper.cancel(pending)
+            raise
+        return pending
+
+    def hello(self, sample_rate=16000, frame_duration=60, timeout=10):
+        # {'transport': 'websocket', 'type': 'hello', 'session_id': 'd2091edb', 'audio_params': {'frame_duration': 60, 'channels': 1, 'format': 'opus', 'sample_rate': 24000}, 'version': 1}
+        resp = self.hello_async(sample_rate, frame_duration, timeout=timeout).get_or_none()
+        # logger.debug("hello resp: ", resp)
+        return resp
 
     def listen(self, state, mode="auto", session_id=""):
-        with self.__resp_helper:
-            self.send(
-                JsonMessage(
-                    {
-                        "session_id": session_id,  # Websocket协议不返回 session_id，所以消息中的会话ID可设置为空
-                        "type": "listen",
-                        "state": state,  # "start": 开始识别; "stop": 停止识别; "detect": 唤醒词检测
-                        "mode": mode  # "auto": 自动停止; "manual": 手动停止; "realtime": 持续监听
-                    }
-                ).to_bytes()
-            )
+        self.send(
+            JsonMessage(
+                {
+                    "session_id": session_id,  # Websocket协议不返回 session_id，所以消息中的会话ID可设置为空
+                    "type": "listen",
+                    "state": state,  # "start": 开始识别; "stop": 停止识别; "detect": 唤醒词检测
+                    "mode": mode  # "auto": 自动停止; "manual": 手动停止; "realtime": 持续监听
+                }
+            ).to_bytes()
+        )
     
     def wakeword_detected(self, wakeword, session_id=""):
-        with self.__resp_helper:
-            self.send(
-                JsonMessage(
-                    {
-                        "session_id": session_id,
-                        "type": "listen",
-                        "state": "detect",
-                        "text": wakeword  # 唤醒词
-                    }
-                ).to_bytes()
-            )
+        self.send(
+            JsonMessage(
+                {
+                    "session_id": session_id,
+                    "type": "listen",
+                    "state": "detect",
+                    "text": wakeword  # 唤醒词
+                }
+            ).to_bytes()
+        )
     
     def abort(self, session_id="", reason=""):
-        with self.__resp_helper:
-            self.send(
-                JsonMessage(
-                    {
-                        "session_id": session_id,
-                        "type": "abort",
-                        "reason": reason
-                    }
-                ).to_bytes()
-            )
+        self.send(
+            JsonMessage(
+                {
+                    "session_id": session_id,
+                    "type": "abort",
+                    "reason": reason
+                }
+            ).to_bytes()
+        )
 
     def report_iot_descriptors(self, descriptors, session_id=""):
-        with self.__resp_helper:
-            self.send(
-                JsonMessage(
-                    {
-                        "session_id": session_id,
-                        "type": "iot",
-                        "descriptors": descriptors
-                    }
-                ).to_bytes()
-            )
+        self.send(
+            JsonMessage(
+                {
+                    "session_id": session_id,
+                    "type": "iot",
+                    "descriptors": descriptors
+                }
+            ).to_bytes()
+        )
 
     def report_iot_states(self, states, session_id=""):
-        with self.__resp_helper:
-            self.send(
-                JsonMessage(
-                    {
-                        "session_id": session_id,
-                        "type": "iot",
-                        "states": states
-                    }
-                ).to_bytes()
-            )
+        self.send(
+            JsonMessage(
+                {
+                    "session_id": session_id,
+                    "type": "iot",
+                    "states": states
+                }
+            ).to_bytes()
+        )
+
+
+class ConnectionManager(object):
+    """WebSocket长连接管理
+
+    在多次会话之间保持同一条已认证的WebSocket连接:
+    - 会话开始时若连接已断开则惰性重连，否则直接复用
+    - 空闲时定时发送ping保活，并检测链路是否已断开: 共享 TimerWheel 上的定时器只做检查并唤醒
+      保活线程，ping 与断开都在保活线程中、不持有连接锁执行，慢速链路不会拖住其他定时器和新会话
+    - 空闲超过 idle_timeout 后主动断开，释放网络资源
+    """
+
+    def __init__(self, client, keepalive_interval=KEEPALIVE_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+        self.client = client
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        self.__cond = Condition(name="connection")
+        self.__sessions = 0
+        self.__idle_since = utime.time()
+        self.__keepalive_timer = Timer(self.__keepalive)
+        self.__keepalive_event = Event()
+        self.__keepalive_thread = None
+        self.__closing = False  # 保活线程正在断开连接
+        self.__started = False
+
+    def __str__(self):
+        return "{}({})".format(type(self).__name__, self.client)
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args, **kwargs):
+        self.release()
+
+    def start(self, prewarm=True):
+        """start keepalive timer, and connect in advance (in a one-off thread) if `prewarm`"""
+        with self.__cond:
+            if self.__started:
+                return
+            self.__started = True
+            if self.__keepalive_thread is None:
+                self.__keepalive_thread = Thread(target=self.__keepalive_worker, name="ws_keepalive")
+                self.__keepalive_thread.start(stack_size=64)
+            self.__keepalive_timer.start(self.keepalive_interval, period=self.keepalive_interval)
+            if prewarm:
+                Thread(target=self.__prewarm, name="ws_prewarm").start(stack_size=64)
+
+    def acquire(self):
+        """begin a session, return a connected WebSocketClient"""
+        with self.__cond:
+            self.__cond.wait_for(lambda: not self.__closing)
+            self.__ensure_connected()
+            self.__sessions += 1
+            return self.client
+
+    def release(self):
+        """end a session, connection is kept warm for next session"""
+        with self.__cond:
+            self.__sessions -= 1
+            self.__idle_since = utime.time()
+
+    def close(self):
+        with self.__cond:
+            self.__keepalive_timer.cancel()
+            self.__started = False
+            self.client.disconnect()
+
+    def __ensure_connected(self):
+        if self.client.is_connected():
+            return
+        # 链路已断开: 先清理旧连接(回收接收线程)再重连
+        self.client.disconnect()
+        logger.info("{} connecting...", self)
+        if self.client.connect() is None:
+            raise RuntimeError("{} connect failed".format(self))
+
+    def __prewarm(self):
+        try:
+            with self.__cond:
+                self.__ensure_connected()
+                self.__idle_since = utime.time()
+        except Exception as e:
+            logger.warn("{} prewarm failed, Exception details: {}", self, repr(e))
+
+    def __keepalive(self):
+        # 定时器回调: 只做检查，耗时操作交给保活线程
+        if self.__sessions > 0 or getattr(self.client, "__client__", None) is None:
+            return
+        self.__keepalive_event.set()
+
+    def __keepalive_worker(self):
+        while True:
+            self.__keepalive_event.wait(clear=True)
+            with self.__cond:
+                if self.__sessions > 0 or getattr(self.client, "__client__", None) is None:
+                    continue
+                idle = utime.time() - self.__idle_since >= self.idle_timeout
+            if not self.client.is_connected():
+                logger.info("{} link dropped, reconnect on next session", self)
+            elif idle:
+                logger.info("{} idle timeout, disconnect", self)
+            else:
+                try:
+                    self.client.ping()
+                    continue
+                except Exception as e:
+                    logger.info("{} ping failed, Exception details: {}", self, repr(e))
+            self.__disconnect_idle()
+
+    def __disconnect_idle(self):
+        """断开空闲连接，期间新会话在 acquire 中等待，之后惰性重连"""
+        with self.__cond:
+            if self.__sessions > 0:
+                # 会话已开始，交给会话自己处理链路
+                return
+            self.__closing = True
+        try:
+            self.client.disconnect()
+        finally:
+            with self.__cond:
+                self.__closing = False
+                self.__cond.notify_all()
+
+
+class UplinkSender(object):
+    """上行音频异步发送
+
+    采集线程只把opus帧放入固定容量的环形缓冲，由独立的发送线程调用 client.send_audio，
+    上行网络阻塞时采集节奏不受影响。缓冲满时按 policy 处理:
+    - DROP_OLDEST: 丢弃最旧的帧
+    - DROP_NEWEST: 丢弃当前帧
+    - BLOCK: 最多等待 timeout 秒，超时后丢弃当前帧
+
+    发送线程落后时一次加锁最多取走 batch 帧再逐帧发送；clear() 会丢弃已取出但未发送的帧。
+    """
+    DROP_OLDEST = 0
+    DROP_NEWEST = 1
+    BLOCK = 2
+
+    def __init__(self, client, capacity=16, policy=DROP_OLDEST, timeout=0.1, batch=4):
+        if policy not in (self.DROP_OLDEST, self.DROP_NEWEST, self.BLOCK):
+            raise ValueError("invalid policy: {}".format(policy))
+        self.client = client
+        self.policy = policy
+        self.timeout = timeout
+        self.__capacity = capacity
+        self.__frames = [None] * capacity
+        self.__enqueue_ticks = [0] * capacity
+        self.__head = 0
+        self.__count = 0
+        self.__sending = False
+        self.__cond = Condition(name="uplink")
+        self.__thread = None
+        self.__batch = max(1, min(batch, capacity))
+        self.__batch_frames = [None] * self.__batch
+        self.__batch_ticks = [0] * self.__batch
+        self.__epoch = 0  # clear() 时递增，作废已取出的帧
+        self.sent = 0
+        self.dropped = 0
+        self.send_errors = 0
+        self.max_depth = 0
+        self.avg_latency = 0  # ms, 入队到发送完成
+        self.max_latency = 0  # ms
+
+    def start(self):
+        with self.__cond:
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__send_thread_worker, name="uplink")
+                self.__thread.start(stack_size=64)
+
+    def put(self, frame):
+        """enqueue a frame, return False if a frame was dropped"""
+        with self.__cond:
+            accepted = True
+            if self.__count >= self.__capacity:
+                if self.policy == self.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.policy == self.BLOCK:
+                    if not self.__cond.wait_for(lambda: self.__count < self.__capacity, timeout=self.timeout):
+                        self.dropped += 1
+                        return False
+                else:
+                    self.__pop()
+                    self.dropped += 1
+                    accepted = False
+            tail = (self.__head + self.__count) % self.__capacity
+            self.__frames[tail] = frame
+            self.__enqueue_ticks[tail] = utime.ticks_ms()
+            self.__count += 1
+            if self.__count > self.max_depth:
+                self.max_depth = self.__count
+            self.__cond.notify_all()
+            return accepted
+
+    def flush(self, timeout=None):
+        """wait until all queued frames are sent"""
+        with self.__cond:
+            return self.__cond.wait_for(lambda: self.__count == 0 and not self.__sending, timeout=timeout)
+
+    def clear(self):
+        with self.__cond:
+            while self.__count:
+                self.__pop()
+            self.__epoch += 1
+            self.__cond.notify_all()
+
+    def stats(self):
+        with self.__cond:
+            return {
+                "depth": self.__count,
+                "max_depth": self.max_depth,
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "send_errors": self.send_errors,
+                "avg_latency_ms": self.avg_latency,
+                "max_latency_ms": self.max_latency
+            }
+
+    def __pop(self):
+        frame = self.__frames[self.__head]
+        enqueue_ticks = self.__enqueue_ticks[self.__head]
+        self.__frames[self.__head] = None
+        self.__head = (self.__head + 1) % self.__capacity
+        self.__count -= 1
+        return frame, enqueue_ticks
+
+    def __send_thread_worker(self):
+        frames = self.__batch_frames
+        ticks = self.__batch_ticks
+        while True:
+            with self.__cond:
+                self.__sending = False
+                self.__cond.notify_all()
+                self.__cond.wait_for(lambda: self.__count > 0)
+                count = min(self.__count, self.__batch)
+                for i in range(count):
+                    frames[i], ticks[i] = self.__pop()
+                epoch = self.__epoch
+                self.__sending = True
+                self.__cond.notify_all()
+            stale = 0
+            for i in range(count):
+                frame = frames[i]
+                frames[i] = None
+                if epoch != self.__epoch:
+                    stale += 1
+                    continue
+                self.__send(frame, ticks[i])
+            if stale:
+                # put() 也会累加 dropped，必须在锁内修改
+                with self.__cond:
+                    self.dropped += stale
+
+    def __send(self, frame, enqueue_ticks):
+        try:
+            self.client.send_audio(frame, enqueue_ticks)
+        except Exception as e:
+            self.send_errors += 1
+            logger.debug("{} send failed, Exception details: {}", self, repr(e))
+            return
+        latency = utime.ticks_diff(utime.ticks_ms(), enqueue_ticks)
+        self.sent += 1
+        self.avg_latency += (latency - self.avg_latency) // 8
+        if latency > self.max_latency:
+            self.max_latency = latency
\ No newline at end of file
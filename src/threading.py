@@ -4,11 +4,35 @@ import _thread
 import osTimer
 
 
+# ticks_ms wraps every 2**30 ms, ticks_diff is only meaningful within half of that
+_MAX_TIMEOUT_MS = 0x1FFFFFFF
+
+
+def _deadline(timeout):
+    """monotonic `utime.ticks_ms` deadline for a timeout in seconds (None: no deadline)"""
+    if timeout is None:
+        return None
+    return utime.ticks_add(utime.ticks_ms(), min(int(timeout * 1000), _MAX_TIMEOUT_MS))
+
+
+def _remaining(deadline):
+    """seconds left before deadline, <= 0 once it has passed (None: no deadline)"""
+    if deadline is None:
+        return None
+    return utime.ticks_diff(deadline, utime.ticks_ms()) / 1000
+
+
 class Lock(object):
+    """Lock recording its owner. Locks given a `name` can be profiled, see `Profiler`."""
 
-    def __init__(self):
+    def __init__(self, name=None):
         self.__lock = _thread.allocate_lock()
         self.__owner = None
+        self.__acquired_at = None
+        self.name = name
+        self._stats = None  # histogram of `name` while the profiler is enabled
+        self.__generation = None
+        self.__sync_profiler()
 
     def __enter__(self):
         self.acquire()
@@ -18,14 +42,43 @@ class Lock(object):
         self.release()
 
     def acquire(self):
+        if self.__generation != Profiler.generation:
+            self.__sync_profiler()
+        stats = self._stats
+        if stats is not None:
+            return self.__profiled_acquire(stats)
         flag = self.__lock.acquire()
         self.__owner = _thread.get_ident()
         return flag
 
     def release(self):
+        if self.__acquired_at is not None:
+            self.__record_hold()
         self.__owner = None
         return self.__lock.release()
 
+    def __sync_profiler(self):
+        # the profiler keeps no reference to locks, each one picks up enable/disable here
+        self.__generation = Profiler.generation
+        self._stats = Profiler._stats_for(self.name) if self.name is not None else None
+
+    def __profiled_acquire(self, stats):
+        start = utime.ticks_us()
+        contended = not self.__lock.acquire(0)
+        if contended:
+            self.__lock.acquire()
+        now = utime.ticks_us()
+        self.__owner = _thread.get_ident()
+        self.__acquired_at = now
+        stats.record_acquire(utime.ticks_diff(now, start), contended, self.__owner)
+        return True
+
+    def __record_hold(self):
+        stats = self._stats
+        if stats is not None:
+            stats.record_hold(utime.ticks_diff(utime.ticks_us(), self.__acquired_at), self.__owner)
+        self.__acquired_at = None
+
     def locked(self):
         return self.__lock.locked()
 
@@ -34,47 +87,227 @@ class Lock(object):
         return self.__owner
 
 
+def _log2_bucket(value):
+    """histogram bucket of value: 0 for 0, i for [2**(i-1), 2**i), capped at the last one"""
+    bucket = 0
+    while value > 0 and bucket < _ContentionStats.BUCKETS - 1:
+        value >>= 1
+        bucket += 1
+    return bucket
+
+
+class _ContentionStats(object):
+    """Acquire wait / hold time histograms (microseconds, log2 buckets) of one lock name."""
+    BUCKETS = 24  # the last bucket takes everything from 2**22 us (~4 s) up
+
+    def __init__(self, name):
+        self.name = name
+        self.wait_us = [0] * self.BUCKETS
+        self.hold_us = [0] * self.BUCKETS
+        self.reset()
+
+    def reset(self):
+        for i in range(self.BUCKETS):
+            self.wait_us[i] = 0
+            self.hold_us[i] = 0
+        self.acquisitions = 0
+        self.contended = 0
+        self.max_wait_us = 0
+        self.max_hold_us = 0
+        self.max_hold_owner = None
+        self.owner = None
+
+    def record_acquire(self, wait, contended, owner):
+        self.acquisitions += 1
+        if contended:
+            self.contended += 1
+        self.wait_us[_log2_bucket(wait)] += 1
+        if wait > self.max_wait_us:
+            self.max_wait_us = wait
+        self.owner = owner
+
+    def record_hold(self, hold, owner):
+        self.hold_us[_log2_bucket(hold)] += 1
+        if hold > self.max_hold_us:
+            self.max_hold_us = hold
+            self.max_hold_owner = owner
+
+    @staticmethod
+    def percentile(histogram, fraction):
+        """upper bound (us) of the bucket holding the given fraction of samples"""
+        total = sum(histogram)
+        if total == 0:
+            return 0
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if seen >= total * fraction:
+                return 1 << bucket if bucket else 0
+        return 1 << (len(histogram) - 1)
+
+    def as_dict(self):
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "wait_us": list(self.wait_us),
+            "hold_us": list(self.hold_us),
+            "max_wait_us": self.max_wait_us,
+            "max_hold_us": self.max_hold_us,
+            "max_hold_owner": self.max_hold_owner,
+            "owner": self.owner
+        }
+
+    def __str__(self):
+        return "{} acquired={} contended={} wait p50<={}us p99<={}us max={}us hold p50<={}us p99<={}us max={}us (thread {}) owner={}".format(
+            self.name, self.acquisitions, self.contended,
+            self.percentile(self.wait_us, 0.5), self.percentile(self.wait_us, 0.99), self.max_wait_us,
+            self.percentile(self.hold_us, 0.5), self.percentile(self.hold_us, 0.99), self.max_hold_us,
+            self.max_hold_owner, self.owner
+        )
+
+
+class Profiler(object):
+    """Opt-in contention profiler for named primitives.
+
+    Every `Lock` created with a name (directly or through `Condition`, `Event`,
+    `Queue`) records, while enabled, acquire wait time, hold time and owner into
+    the fixed-size histograms of its name. Primitives sharing a name share one
+    histogram. Only the histograms are kept here: enable/disable bump `generation`
+    and each lock looks its histogram up again on its next acquire, so locks can
+    be freed as usual. Disabled, a lock pays one generation check.
+
+        Profiler.enable()
+        ...
+        Profiler.dump()
+    """
+    enabled = False
+    generation = 0
+    __lock = _thread.allocate_lock()
+    __stats = {}
+
+    @classmethod
+    def _stats_for(cls, name):
+        """histogram of name while enabled, else None"""
+        with cls.__lock:
+            if not cls.enabled:
+                return None
+            stats = cls.__stats.get(name)
+            if stats is None:
+                stats = cls.__stats[name] = _ContentionStats(name)
+            return stats
+
+    @classmethod
+    def enable(cls):
+        with cls.__lock:
+            cls.enabled = True
+            cls.generation += 1
+
+    @classmethod
+    def disable(cls):
+        with cls.__lock:
+            cls.enabled = False
+            cls.generation += 1
+
+    @classmethod
+    def reset(cls):
+        with cls.__lock:
+            for stats in cls.__stats.values():
+                stats.reset()
+
+    @classmethod
+    def snapshot(cls):
+        """return {name: stats dict}"""
+        with cls.__lock:
+            return dict((name, stats.as_dict()) for name, stats in cls.__stats.items())
+
+    @classmethod
+    def dump(cls, stream=None):
+        """write one line per name, most contended first"""
+        if stream is None:
+            stream = sys.stdout
+        with cls.__lock:
+            items = sorted(cls.__stats.values(), key=lambda stats: stats.contended, reverse=True)
+        for stats in items:
+            stream.write("{}\n".format(stats))
+
+
 class _Waiter(object):
-    """WARNING: Waiter object can only be used once."""
+    """One-shot wake-up slot for `Condition.wait`.
+
+    Waiters are recycled through a small pool (see `_Waiter.get` / `_Waiter.put`),
+    so the lock and the timeout `Timer` are allocated once per waiter, not per wait.
+    Timeouts run on the shared wheel and are rounded up to its tick; ones shorter
+    than a tick poll the lock every millisecond instead.
+    """
+    POOL_SIZE = 16
+    __pool = []
+    __pool_lock = _thread.allocate_lock()
 
     def __init__(self):
-        self.__lock = Lock()
+        self.__lock = _thread.allocate_lock()
         self.__lock.acquire()
-        self.__gotit = True
+        self.__timer = None
+        self.__timer_lock = None
+        self.__armed = False
+        self.__generation = 0  # bumped per arm, passed to the timer callback
+        self.__timed_out = False
 
-    @property
-    def __unlock_timer(self):
-        timer = getattr(self, "__unlock_timer__", None)
-        if timer is None:
-            timer = osTimer()
-            setattr(self, "__unlock_timer__", timer)
-        return timer
-
-    @property
-    def __timer_lock(self):
-        lock = getattr(self, "__timer_lock__", None)
-        if lock is None:
-            lock = Lock()
-            setattr(self, "__timer_lock__", lock)
-        return lock
+    @classmethod
+    def get(cls):
+        with cls.__pool_lock:
+            if cls.__pool:
+                return cls.__pool.pop()
+        return cls()
 
-    def __auto_release(self, _):
+    @classmethod
+    def put(cls, waiter):
+        # a release racing with the timeout may have left the lock free: take it back
+        waiter.__lock.acquire(0)
+        with cls.__pool_lock:
+            if len(cls.__pool) < cls.POOL_SIZE:
+                cls.__pool.append(waiter)
+
+    def __auto_release(self, generation):
         with self.__timer_lock:
-            self.__gotit = not self.__release()
+            # an expiry left over from an earlier arm must not wake the current owner
+            if self.__armed and generation == self.__generation:
+                self.__armed = False
+                self.__timed_out = self.__release()
 
     def acquire(self, timeout=None):
+        """block until released; return False if woken by the timeout"""
         if timeout is not None and timeout <= 0:
             raise ValueError("\"timeout\" must be a positive number.")
-        gotit = self.__gotit
+        if timeout and timeout * 1000 < TimerWheel.default().tick_ms:
+            return self.__poll(int(timeout * 1000000))
         if timeout:
+            if self.__timer is None:
+                self.__timer = Timer(self.__auto_release, inline=True)
+                self.__timer_lock = _thread.allocate_lock()
             with self.__timer_lock:
-                self.__unlock_timer.start(timeout * 1000, 0, self.__auto_release)
+                self.__generation = (self.__generation + 1) & 0x3FFFFFFF
+                generation = self.__generation
+                self.__armed = True
+                self.__timed_out = False
+            self.__timer.start(timeout, args=(generation, ))
         self.__lock.acquire()  # block here
         if timeout:
+            self.__timer.cancel()
             with self.__timer_lock:
-                gotit = self.__gotit
-            self.__unlock_timer.stop()
-        return gotit
+                self.__armed = False
+                timed_out = self.__timed_out
+                self.__timed_out = False
+            return not timed_out
+        return True
+
+    def __poll(self, timeout_us):
+        # raw locks take no timeout, and a wheel timer would round up to a whole tick
+        deadline = utime.ticks_add(utime.ticks_us(), timeout_us)
+        while not self.__lock.acquire(0):
+            if utime.ticks_diff(deadline, utime.ticks_us()) <= 0:
+                return False
+            utime.sleep_ms(1)
+        return True
 
     def __release(self):
         try:
@@ -89,9 +322,9 @@ class _Waiter(object):
 
 class Condition(object):
 
-    def __init__(self, lock=None):
+    def __init__(self, lock=None, name=None):
         if lock is None:
-            lock = Lock()
+            lock = Lock(name)
         self.__lock = lock
         self.__waiters = []
         self.acquire = self.__lock.acquire
@@ -110,32 +343,34 @@ class Condition(object):
     def wait(self, timeout=None):
         if not self.__is_owned():
             raise RuntimeError("cannot wait on un-acquired lock.")
-        waiter = _Waiter()
+        waiter = _Waiter.get()
         self.__waiters.append(waiter)
         self.release()
         gotit = False
         try:
             gotit = waiter.acquire(timeout)
-            return gotit
         finally:
             self.acquire()
             if not gotit:
                 try:
                     self.__waiters.remove(waiter)
                 except ValueError:
-                    pass
+                    # notified while timing out: count it as notified
+                    gotit = True
+        _Waiter.put(waiter)
+        return gotit
 
     def wait_for(self, predicate, timeout=None):
-        endtime = None
+        deadline = None
         remaining = timeout
         result = predicate()
         while not result:
             if remaining is not None:
-                if endtime is None:
-                    endtime = utime.time() + remaining
+                if deadline is None:
+                    deadline = _deadline(remaining)
                 else:
-                    remaining = endtime - utime.time()
-                    if remaining <= 0.0:
+                    remaining = _remaining(deadline)
+                    if remaining <= 0:
                         break
             self.wait(remaining)
             result = predicate()
@@ -160,9 +395,9 @@ class Condition(object):
 
 class Event(object):
 
-    def __init__(self):
+    def __init__(self, name=None):
         self.__flag = False
-        self.__cond = Condition()
+        self.__cond = Condition(name=name)
 
     def wait(self, timeout=None, clear=False):
         with self.__cond:
@@ -286,76 +521,177 @@ class BoundedSemaphore(Semaphore):
 
 
 class Queue(object):
-    
+    """FIFO queue backed by a circular buffer allocated once at construction."""
+
     class Full(Exception):
         pass
 
     class Empty(Exception):
         pass
 
-    def __init__(self, max_size=100):
-        self.queue = []
+    def __init__(self, max_size=100, name=None):
+        if max_size <= 0:
+            raise ValueError("max_size must be greater than 0.")
         self.__max_size = max_size
-        self.__lock = Lock()
+        self.__lock = Lock(name)
         self.__not_empty = Condition(self.__lock)
         self.__not_full = Condition(self.__lock)
+        # bound once, so put/get do not build a predicate per call
+        self.__has_items = self.__is_not_empty
+        self.__has_room = self.__is_not_full
+        self._init(max_size)
+
+    def __is_not_empty(self):
+        return self._qsize() != 0
+
+    def __is_not_full(self):
+        return self._qsize() < self.__max_size
+
+    # storage hooks, called with the lock held
+
+    def _init(self, max_size):
+        self.queue = [None] * max_size
+        self._head = 0
+        self._size = 0
+
+    def _qsize(self):
+        return self._size
 
     def _put(self, item):
-        self.queue.append(item)
+        tail = self._head + self._size
+        if tail >= len(self.queue):
+            tail -= len(self.queue)
+        self.queue[tail] = item
+        self._size += 1
+
+    def _get(self):
+        head = self._head
+        item = self.queue[head]
+        self.queue[head] = None
+        head += 1
+        self._head = 0 if head == len(self.queue) else head
+        self._size -= 1
+        return item
+
+    def _clear(self):
+        for i in range(len(self.queue)):
+            self.queue[i] = None
+        self._head = 0
+        self._size = 0
 
     def put(self, item, block=True, timeout=None):
         with self.__not_full:
             if not block:
-                if len(self.queue) >= self.__max_size:
+                if self._qsize() >= self.__max_size:
                     raise self.Full
             elif timeout is not None and timeout <= 0:
                 raise ValueError("\"timeout\" must be a positive number.")
             else:
-                if not self.__not_full.wait_for(lambda: len(self.queue) < self.__max_size, timeout=timeout):
+                if not self.__not_full.wait_for(self.__has_room, timeout=timeout):
                     raise self.Full
             self._put(item)
             self.__not_empty.notify()
 
-    def _get(self):
-        return self.queue.pop(0)
-
     def get(self, block=True, timeout=None):
         with self.__not_empty:
             if not block:
-                if len(self.queue) == 0:
+                if self._qsize() == 0:
                     raise self.Empty
             elif timeout is not None and timeout <= 0:
                 raise ValueError("\"timeout\" must be a positive number.")
             else:
-                if not self.__not_empty.wait_for(lambda: len(self.queue) != 0, timeout=timeout):
+                if not self.__not_empty.wait_for(self.__has_items, timeout=timeout):
                     raise self.Empty
             item = self._get()
             self.__not_full.notify()
             return item
 
+    def put_many(self, items, block=True, timeout=None):
+        """put items in order under one lock acquisition per free-space window.
+
+        Consumers are woken once per window rather than once per item. When
+        the queue is full the call waits like `put`; on timeout (or at once
+        with block=False) it stops early. Returns the number of items put.
+        """
+        if block and timeout is not None and timeout <= 0:
+            raise ValueError("\"timeout\" must be a positive number.")
+        total = len(items)
+        count = 0
+        deadline = _deadline(timeout)
+        with self.__not_full:
+            while count < total:
+                if self._qsize() >= self.__max_size:
+                    if not block:
+                        break
+                    remaining = _remaining(deadline)
+                    if remaining is not None and remaining <= 0:
+                        break
+                    if not self.__not_full.wait_for(self.__has_room, timeout=remaining):
+                        break
+                added = 0
+                while count < total and self._qsize() < self.__max_size:
+                    self._put(items[count])
+                    count += 1
+                    added += 1
+                self.__not_empty.notify(added)
+        return count
+
+    def get_many(self, max_items=None, block=True, timeout=None):
+        """get up to max_items (all queued items if None) under one lock acquisition.
+
+        Waits like `get` until at least one item is queued, then takes what is
+        there without waiting for more. Returns a list, empty on timeout or
+        when the queue is empty and block=False.
+        """
+        items = []
+        with self.__not_empty:
+            if not block:
+                if self._qsize() == 0:
+                    return items
+            elif timeout is not None and timeout <= 0:
+                raise ValueError("\"timeout\" must be a positive number.")
+            else:
+                if not self.__not_empty.wait_for(self.__has_items, timeout=timeout):
+                    return items
+            count = self._qsize()
+            if max_items is not None and max_items < count:
+                count = max_items
+            for _ in range(count):
+                items.append(self._get())
+            self.__not_full.notify(count)
+        return items
+
+    def drain(self):
+        """remove and return every queued item without blocking"""
+        return self.get_many(block=False)
+
     def size(self):
         with self.__lock:
-            return len(self.queue)
+            return self._qsize()
 
     def clear(self):
         with self.__lock:
-            self.queue.clear()
+            self._clear()
+            self.__not_full.notify_all()
 
 
 class LifoQueue(Queue):
 
-    def _put(self, item):
-        self.queue.append(item)
-
     def _get(self):
-        return self.queue.pop()
+        self._size -= 1
+        tail = self._head + self._size
+        if tail >= len(self.queue):
+            tail -= len(self.queue)
+        item = self.queue[tail]
+        self.queue[tail] = None
+        return item
 
 
 class PriorityQueue(Queue):
 
-    def __init__(self, max_size=100):
+    def __init__(self, max_size=100, name=None):
         self.__counter = 0
-        super().__init__(max_size)
+        super().__init__(max_size, name)
 
     @classmethod
     def __siftdown(cls, heap, startpos, pos):
@@ -372,12 +708,12 @@ class PriorityQueue(Queue):
 
     def _put(self, item):
         self.__counter += 1
-        self.queue.append((item, self.__counter))
-        self.__siftdown(self.queue, 0, len(self.queue) - 1)
+        self.queue[self._size] = (item, self.__counter)
+        self._size += 1
+        self.__siftdown(self.queue, 0, self._size - 1)
 
     @classmethod
-    def __siftup(cls, heap, pos):
-        endpos = len(heap)
+    def __siftup(cls, heap, pos, endpos):
         startpos = pos
         newitem = heap[pos]
         childpos = 2 * pos + 1
@@ -392,24 +728,47 @@ class PriorityQueue(Queue):
         cls.__siftdown(heap, startpos, pos)
 
     def _get(self):
-        lastelt = self.queue.pop()
-        if self.queue:
+        self._size -= 1
+        lastelt = self.queue[self._size]
+        self.queue[self._size] = None
+        if self._size:
             returnitem = self.queue[0]
             self.queue[0] = lastelt
-            self.__siftup(self.queue, 0)
+            self.__siftup(self.queue, 0, self._size)
             return returnitem[0]
         return lastelt[0]
 
 
 class Thread(object):
+    """Named thread, listed in `ThreadRegistry` while it runs."""
     DEFAULT_STACK_SIZE = _thread.stack_size()
+    # _thread.stack_size is global: set, start and restore it as one step
+    __start_lock = _thread.allocate_lock()
+    __count = 0
 
-    def __init__(self, target=None, args=(), kwargs=None):
+    def __init__(self, target=None, args=(), kwargs=None, name=None):
         self.__target = target
         self.__args = args
         self.__kwargs = kwargs or {}
         self.__ident = None
         self.__stopped_event = Event()
+        if name is None:
+            with self.__start_lock:
+                Thread.__count += 1
+                name = "Thread-{}".format(Thread.__count)
+        self.name = name
+        self.stack_size = None  # KB, None for DEFAULT_STACK_SIZE
+        # heartbeat bookkeeping, see `heartbeat` and `ThreadRegistry`
+        self.started_ticks = None
+        self.beats = 0
+        self.stalls = 0
+        self.max_gap_ms = 0
+        self._beat_ticks = None
+        self._deadline_ms = None
+        self._stalled = False
+
+    def __str__(self):
+        return "<Thread {} {}>".format(self.name, self.__ident)
 
     def is_running(self):
         if self.__ident is None:
@@ -424,24 +783,33 @@ class Thread(object):
         """WARNING: you must release all resources after terminate thread, especially **Lock(s)**"""
         if self.is_running():
             _thread.stop_thread(self.ident)
+            ThreadRegistry._remove(self.ident)
             self.__ident = None
         self.__stopped_event.set()
 
     def start(self, stack_size=None):
         if self.__ident is not None:
             raise RuntimeError("threads can only be started once")
-        if stack_size is not None:
-            _thread.stack_size(stack_size * 1024)
-        self.__ident = _thread.start_new_thread(self.__bootstrap, ())
-        if stack_size is not None:
-            _thread.stack_size(self.DEFAULT_STACK_SIZE)
+        with self.__start_lock:
+            if stack_size is not None:
+                _thread.stack_size(stack_size * 1024)
+            try:
+                self.__ident = _thread.start_new_thread(self.__bootstrap, ())
+            finally:
+                if stack_size is not None:
+                    _thread.stack_size(self.DEFAULT_STACK_SIZE)
+        self.stack_size = stack_size
 
     def __bootstrap(self):
+        ident = _thread.get_ident()
+        self.started_ticks = self._beat_ticks = utime.ticks_ms()
+        ThreadRegistry._add(ident, self)
         try:
             self.run()
         except Exception as e:
             sys.print_exception(e)
         finally:
+            ThreadRegistry._remove(ident)
             self.__stopped_event.set()
 
     def run(self):
@@ -452,8 +820,143 @@ class Thread(object):
     def ident(self):
         return self.__ident
 
+    def _beat(self, deadline):
+        if deadline is None and self._deadline_ms is None:
+            # not watched, nothing to record
+            return
+        now = utime.ticks_ms()
+        if self._deadline_ms is not None:
+            gap = utime.ticks_diff(now, self._beat_ticks)
+            if gap > self.max_gap_ms:
+                self.max_gap_ms = gap
+        self._beat_ticks = now
+        self._deadline_ms = None if deadline is None else int(deadline * 1000)
+        self._stalled = False
+        self.beats += 1
+
+
+def heartbeat(deadline=None):
+    """post a heartbeat from the current `Thread`.
+
+    The next one is due within `deadline` seconds, or the stall detector reports
+    the thread; None stops watching it (e.g. before blocking on idle input) and
+    is a no-op if it is not watched. No-op in threads not started through `Thread`.
+    """
+    thread = ThreadRegistry.current()
+    if thread is not None:
+        thread._beat(deadline)
+
+
+class ThreadRegistry(object):
+    """Live table of running `Thread`s, with heartbeat based stall detection.
+
+    `watch()` checks every `interval` seconds, on the shared timer wheel, that each
+    thread which posted a heartbeat with a deadline posted the next one in time, and
+    passes late ones once per stall to `callback(thread, gap_ms)`.
+    """
+    __lock = _thread.allocate_lock()
+    __threads = {}  # ident -> Thread
+    __watchdog = None
+
+    @classmethod
+    def _add(cls, ident, thread):
+        with cls.__lock:
+            cls.__threads[ident] = thread
+
+    @classmethod
+    def _remove(cls, ident):
+        with cls.__lock:
+            cls.__threads.pop(ident, None)
+
+    @classmethod
+    def current(cls):
+        # hot path (every heartbeat): a single dict lookup is atomic, no lock needed
+        return cls.__threads.get(_thread.get_ident())
+
+    @classmethod
+    def threads(cls):
+        with cls.__lock:
+            return list(cls.__threads.values())
+
+    @classmethod
+    def table(cls):
+        """return one dict per running thread"""
+        now = utime.ticks_ms()
+        rows = []
+        for thread in cls.threads():
+            rows.append({
+                "name": thread.name,
+                "ident": thread.ident,
+                "state": "stalled" if thread._stalled else "running",
+                "stack_size": thread.stack_size,
+                "age_ms": utime.ticks_diff(now, thread.started_ticks),
+                "beats": thread.beats,
+                "since_beat_ms": utime.ticks_diff(now, thread._beat_ticks),
+                "deadline_ms": thread._deadline_ms,
+                "stalls": thread.stalls,
+                "max_gap_ms": thread.max_gap_ms
+            })
+        return rows
+
+    @classmethod
+    def dump(cls, stream=None):
+        if stream is None:
+            stream = sys.stdout
+        for row in cls.table():
+            stream.write(
+                "{} ident={} {} stack={} age={}ms beats={} since_beat={}ms deadline={} stalls={} max_gap={}ms\n".format(
+                    row["name"], row["ident"], row["state"],
+                    "default" if row["stack_size"] is None else "{}KB".format(row["stack_size"]),
+                    row["age_ms"], row["beats"], row["since_beat_ms"],
+                    "-" if row["deadline_ms"] is None else "{}ms".format(row["deadline_ms"]),
+                    row["stalls"], row["max_gap_ms"]
+                )
+            )
+
+    @classmethod
+    def check(cls, callback=None):
+        """report threads past their heartbeat deadline, return them"""
+        now = utime.ticks_ms()
+        stalled = []
+        for thread in cls.threads():
+            deadline = thread._deadline_ms
+            if deadline is None or thread._stalled:
+                continue
+            gap = utime.ticks_diff(now, thread._beat_ticks)
+            if gap > deadline:
+                thread._stalled = True
+                thread.stalls += 1
+                stalled.append(thread)
+                if callback is not None:
+                    callback(thread, gap)
+                else:
+                    sys.stdout.write("{} stalled: no heartbeat for {}ms (deadline {}ms)\n".format(thread, gap, deadline))
+        return stalled
+
+    @classmethod
+    def watch(cls, interval=1, callback=None):
+        """start (or restart) the periodic stall detector"""
+        with cls.__lock:
+            if cls.__watchdog is None:
+                cls.__watchdog = Timer(cls.check)
+            cls.__watchdog.args = (callback, )
+            cls.__watchdog.start(interval, period=interval)
+
+    @classmethod
+    def unwatch(cls):
+        with cls.__lock:
+            if cls.__watchdog is not None:
+                cls.__watchdog.cancel()
+
+
+class Future(object):
+    """Result of an asynchronous call.
 
-class _Result(object):
+    Besides blocking on `get`, callers can register `add_done_callback` or chain
+    work with `then`, so no thread has to be parked per outstanding result.
+    Callbacks run in the thread that completes the future (or at once in the
+    caller if it is already done); keep them short.
+    """
 
     class TimeoutError(Exception):
         pass
@@ -461,15 +964,100 @@ class _Result(object):
     class NotReadyError(Exception):
         pass
 
+    class CancelledError(Exception):
+        pass
+
+    __lock = _thread.allocate_lock()
+
     def __init__(self):
         self.__rv = None
         self.__exc = None
+        self.__running = False
+        self.__cancelled = False
         self.__finished = Event()
+        self.__callbacks = []
 
     def set(self, exc=None, rv=None):
-        self.__exc = exc
-        self.__rv = rv
-        self.__finished.set()
+        """complete the future, return False if it was already done (e.g. cancelled)"""
+        with self.__lock:
+            if self.__callbacks is None:
+                return False
+            self.__exc = exc
+            self.__rv = rv
+            callbacks = self.__callbacks
+            self.__callbacks = None
+            self.__finished.set()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                sys.print_exception(e)
+        return True
+
+    def cancel(self):
+        """cancel unless already running or done, return True if cancelled"""
+        with self.__lock:
+            if self.__running or self.__callbacks is None:
+                return False
+            self.__cancelled = True
+        return self.set(exc=self.CancelledError("cancelled"))
+
+    def _start(self):
+        """mark as running, return False if cancelled meanwhile"""
+        with self.__lock:
+            if self.__cancelled or self.__callbacks is None:
+                return False
+            self.__running = True
+            return True
+
+    def done(self):
+        return self.__finished.is_set()
+
+    def running(self):
+        return self.__running and not self.done()
+
+    def cancelled(self):
+        return self.__cancelled
+
+    def add_done_callback(self, callback):
+        """call `callback(future)` once done, at once if already done"""
+        with self.__lock:
+            if self.__callbacks is not None:
+                self.__callbacks.append(callback)
+                return
+        callback(self)
+
+    def remove_done_callback(self, callback):
+        with self.__lock:
+            if self.__callbacks is not None and callback in self.__callbacks:
+                self.__callbacks.remove(callback)
+
+    def then(self, func):
+        """return a Future of `func(result)`; if `func` returns a Future, of its result.
+
+        An exception (or cancellation) of this future skips `func` and is passed on.
+        """
+        future = Future()
+
+        def on_done(source):
+            if source.__exc is not None:
+                future.set(exc=source.__exc)
+                return
+            try:
+                rv = func(source.__rv)
+            except Exception as e:
+                future.set(exc=e)
+                return
+            if isinstance(rv, Future):
+                rv.add_done_callback(future.__set_from)
+            else:
+                future.set(rv=rv)
+
+        self.add_done_callback(on_done)
+        return future
+
+    def __set_from(self, source):
+        self.set(exc=source.__exc, rv=source.__rv)
 
     def __get_value_or_raise_exc(self):
         if self.__exc:
@@ -487,6 +1075,9 @@ class _Result(object):
             raise self.TimeoutError("get result timeout.")
 
 
+_Result = Future
+
+
 class AsyncTask(object):
 
     def __init__(self, target=None, args=(), kwargs=None):
@@ -495,13 +1086,22 @@ class AsyncTask(object):
         self.__kwargs = kwargs or {}
 
     def delay(self, seconds=None):
-        result = _Result()
-        Thread(target=self.__run, args=(result, seconds)).start()
+        result = Future()
+        if seconds is not None and seconds > 0:
+            # wait on the timer wheel, not in a sleeping thread
+            Timer(self.__start, args=(result, )).start(seconds)
+        else:
+            self.__start(result)
         return result
 
-    def __run(self, result, delay_seconds):
-        if delay_seconds is not None and delay_seconds > 0:
-            utime.sleep(delay_seconds)
+    def __start(self, result):
+        if result.done():
+            return  # cancelled while delayed
+        Thread(target=self.__run, args=(result, ), name="async_task").start()
+
+    def __run(self, result):
+        if not result._start():
+            return
         try:
             rv = self.__target(*self.__args, **self.__kwargs)
         except Exception as e:
@@ -523,9 +1123,11 @@ class _WorkItem(object):
         self.__target = target
         self.__args = args
         self.__kwargs = kwargs or {}
-        self.result = _Result()
+        self.result = Future()
 
     def __call__(self, *args, **kwargs):
+        if not self.result._start():
+            return
         try:
             rv = self.__target(*self.__args, **self.__kwargs)
         except Exception as e:
@@ -534,41 +1136,449 @@ class _WorkItem(object):
             self.result.set(rv=rv)
 
 
-def _worker(work_queue):
-    while True:
-        try:
-            task = work_queue.get()
-            task()
-        except Exception as e:
-            sys.print_exception(e)
-
-
 class ThreadPoolExecutor(object):
+    """Thread pool with idle worker reuse and reaping, and a bounded work queue.
+
+    A worker is only started when queued work outnumbers idle workers, and retires
+    after `keepalive` seconds without work. `submit` blocks while `queue_size` items
+    are waiting (back-pressure). `stack_size` is in KB, as for `Thread.start`.
+    """
 
-    def __init__(self, max_workers=4):
+    def __init__(self, max_workers=4, queue_size=100, keepalive=30, stack_size=None):
         if max_workers <= 0:
             raise ValueError("max_workers must be greater than 0.")
         self.__max_workers = max_workers
-        self.__work_queue = Queue()
+        self.__work_queue = Queue(queue_size)
         self.__threads = set()
         self.__lock = Lock()
+        self.__shutdown = False
+        self.__waiting = 0  # workers blocked on the work queue
+        self.keepalive = keepalive
+        self.stack_size = stack_size
+        self.peak_workers = 0
+        self.completed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.shutdown(wait=True)
 
     def submit(self, *args, **kwargs):
         with self.__lock:
-            item = _WorkItem(*args, **kwargs)
-            self.__work_queue.put(item)
+            if self.__shutdown:
+                raise RuntimeError("cannot submit after shutdown.")
+        item = _WorkItem(*args, **kwargs)
+        self.__work_queue.put(item)  # blocks while the queue is full
+        with self.__lock:
             self.__adjust_thread_count()
-            return item.result
+        return item.result
+
+    def map(self, func, *iterables, timeout=None):
+        """like the builtin `map`, calls run in the pool; results are yielded in order"""
+        deadline = _deadline(timeout)
+        results = [self.submit(func, args) for args in zip(*iterables)]
+
+        def result_iterator():
+            for result in results:
+                yield _get_result(result, deadline)
+        return result_iterator()
 
     def __adjust_thread_count(self):
-        if len(self.__threads) < self.__max_workers:
-            t = Thread(target=_worker, args=(self.__work_queue, ))
-            t.start()
-            self.__threads.add(t)
+        if self.__work_queue.size() <= self.__waiting or len(self.__threads) >= self.__max_workers:
+            return
+        t = Thread(target=self.__worker, name="pool_worker")
+        self.__threads.add(t)
+        if len(self.__threads) > self.peak_workers:
+            self.peak_workers = len(self.__threads)
+        t.start(stack_size=self.stack_size)
+
+    def __worker(self):
+        while True:
+            with self.__lock:
+                self.__waiting += 1
+            try:
+                item = self.__work_queue.get(timeout=self.keepalive)
+            except Queue.Empty:
+                item = None
+            with self.__lock:
+                self.__waiting -= 1
+                if item is None and (self.__shutdown or self.__work_queue.size() == 0):
+                    self.__remove_current_thread()
+                    return
+            if item is None:
+                continue
+            try:
+                item()
+            except Exception as e:
+                sys.print_exception(e)
+            with self.__lock:
+                self.completed += 1
+
+    def __remove_current_thread(self):
+        ident = _thread.get_ident()
+        for t in self.__threads:
+            if t.ident == ident:
+                self.__threads.remove(t)
+                return
+
+    def shutdown(self, wait=True):
+        """stop accepting work; workers finish the queued work, then exit"""
+        with self.__lock:
+            self.__shutdown = True
+            threads = list(self.__threads)
+        for _ in threads:
+            self.__work_queue.put(None)
+        if wait:
+            for t in threads:
+                t.join()
+
+    def stats(self):
+        with self.__lock:
+            return {
+                "live_workers": len(self.__threads),
+                "peak_workers": self.peak_workers,
+                "idle_workers": self.__waiting,
+                "queued": self.__work_queue.size(),
+                "completed": self.completed
+            }
+
+
+FIRST_COMPLETED = "FIRST_COMPLETED"
+ALL_COMPLETED = "ALL_COMPLETED"
+
+
+def _get_result(result, deadline):
+    remaining = _remaining(deadline)
+    if remaining is not None and remaining <= 0:
+        if not result.done():
+            raise Future.TimeoutError("get result timeout.")
+        remaining = None
+    return result.get(timeout=remaining)
+
+
+def wait(results, timeout=None, return_when=ALL_COMPLETED):
+    """wait for `results`, return two lists (done, not_done)"""
+    if return_when not in (FIRST_COMPLETED, ALL_COMPLETED):
+        raise ValueError("invalid return_when: {}".format(return_when))
+    results = list(results)
+    cond = Condition()
+
+    def on_done(_):
+        with cond:
+            cond.notify_all()
+
+    def finished():
+        count = 0
+        for result in results:
+            if result.done():
+                count += 1
+        return count == len(results) or (return_when == FIRST_COMPLETED and count > 0)
+
+    for result in results:
+        result.add_done_callback(on_done)
+    try:
+        with cond:
+            cond.wait_for(finished, timeout=timeout)
+    finally:
+        for result in results:
+            result.remove_done_callback(on_done)
+    done = [result for result in results if result.done()]
+    not_done = [result for result in results if not result.done()]
+    return done, not_done
+
+
+def as_completed(results, timeout=None):
+    """yield `results` as they complete; raises `Future.TimeoutError` on timeout"""
+    deadline = _deadline(timeout)
+    results = list(results)
+    if not results:
+        return
+    finished = Queue(len(results))
+    put = finished.put
+    for result in results:
+        result.add_done_callback(put)
+    try:
+        for _ in range(len(results)):
+            remaining = _remaining(deadline)
+            try:
+                if remaining is not None and remaining <= 0:
+                    yield finished.get(block=False)
+                else:
+                    yield finished.get(timeout=remaining)
+            except Queue.Empty:
+                raise Future.TimeoutError("as_completed timeout.")
+    finally:
+        for result in results:
+            result.remove_done_callback(put)
+
+
+class TimerWheel(object):
+    """Hashed timer wheel driving every `Timer`.
+
+    Timers are hashed into `slots` buckets by expiry tick, so starting, cancelling
+    and expiring a timer is O(1) whatever the number of timers. A single thread
+    advances the wheel; it parks on a raw lock that one `osTimer` releases at the
+    nearest expiry (or `_schedule`, for an earlier timer), so a long timer costs
+    one wake-up, not one per tick. Callbacks run on `workers` executor threads;
+    `inline` ones run on the wheel thread itself. A periodic callback that finds
+    the executor queue full is skipped for that period and counted in `overruns`;
+    one-shot callbacks are never dropped, they are retried every tick.
+    """
+    __default = None
+    __default_lock = _thread.allocate_lock()
+
+    def __init__(self, tick_ms=10, slots=64, workers=1, capacity=32, stack_size=64):
+        if tick_ms <= 0 or slots <= 0 or workers <= 0:
+            raise ValueError("tick_ms, slots and workers must be greater than 0.")
+        self.tick_ms = tick_ms
+        self.overruns = 0
+        self.__slots = [[] for _ in range(slots)]
+        self.__cursor = 0
+        self.__last = utime.ticks_ms()
+        self.__pending = 0
+        self.__lock = _thread.allocate_lock()
+        self.__wakeup = _thread.allocate_lock()
+        self.__wakeup.acquire()
+        self.__os_timer = osTimer()
+        self.__on_os_timer = self.__os_timer_callback
+        self.__idle = False
+        self.__sleep_until = None  # ticks_ms the wheel thread sleeps until, None: no timer pending
+        self.__thread = None
+        self.__workers = workers
+        self.__stack_size = stack_size
+        self.__ready = Queue(capacity)
+        self.__due = []
+        self.__backlog = []  # one-shot timers the executor queue had no room for
+
+    @classmethod
+    def default(cls):
+        """the wheel shared by timers created without an explicit one"""
+        with cls.__default_lock:
+            if cls.__default is None:
+                cls.__default = cls()
+            return cls.__default
+
+    def pending(self):
+        with self.__lock:
+            return self.__pending
+
+    def _schedule(self, timer, delay_ms, period_ms, args=None):
+        with self.__lock:
+            if args is not None:
+                timer.args = args
+            if self.__thread is None:
+                self.__start()
+            if timer._slot is not None:
+                self.__unlink(timer)
+            if self.__idle:
+                # the wheel did not advance while idle, restart it from now
+                self.__idle = False
+                self.__last = utime.ticks_ms()
+            elapsed = utime.ticks_diff(utime.ticks_ms(), self.__last)
+            timer._period = (period_ms + self.tick_ms - 1) // self.tick_ms
+            timer._due = False
+            ticks = self.__link(timer, (delay_ms + elapsed + self.tick_ms - 1) // self.tick_ms)
+            due_at = utime.ticks_add(self.__last, ticks * self.tick_ms)
+            if self.__sleep_until is None or utime.ticks_diff(due_at, self.__sleep_until) < 0:
+                self.__sleep_until = due_at
+                self.__kick()
+
+    def _cancel(self, timer):
+        with self.__lock:
+            timer._period = 0
+            timer._due = False
+            if timer._slot is not None:
+                self.__unlink(timer)
+
+    def __link(self, timer, ticks):
+        if ticks < 1:
+            ticks = 1
+        slots = len(self.__slots)
+        timer._slot = (self.__cursor + ticks) % slots
+        timer._rounds = (ticks - 1) // slots
+        self.__slots[timer._slot].append(timer)
+        self.__pending += 1
+        return ticks
+
+    def __unlink(self, timer):
+        self.__slots[timer._slot].remove(timer)
+        timer._slot = None
+        self.__pending -= 1
+
+    def __start(self):
+        self.__thread = Thread(target=self.__wheel_thread_worker, name="timer_wheel")
+        self.__thread.start()
+        for _ in range(self.__workers):
+            Thread(target=self.__executor_thread_worker, name="timer_executor").start(stack_size=self.__stack_size)
+
+    def __kick(self):
+        try:
+            self.__wakeup.release()
+        except RuntimeError:
+            pass  # already released, the wheel thread has not consumed the last wake-up yet
+
+    def __os_timer_callback(self, args):
+        self.__kick()
+
+    def __next_expiry(self):
+        """ticks from the cursor to the earliest linked timer, None if none is linked"""
+        slots = len(self.__slots)
+        nearest = None
+        for distance in range(1, slots + 1):
+            if nearest is not None and nearest <= distance:
+                break
+            for timer in self.__slots[(self.__cursor + distance) % slots]:
+                ticks = distance + timer._rounds * slots
+                if nearest is None or ticks < nearest:
+                    nearest = ticks
+        return nearest
+
+    def __skip(self, ticks):
+        """move the cursor `ticks` ticks at once; no timer may expire within them"""
+        slots = len(self.__slots)
+        for distance in range(1, min(ticks, slots) + 1):
+            passes = (ticks - distance) // slots + 1
+            for timer in self.__slots[(self.__cursor + distance) % slots]:
+                timer._rounds -= passes
+        self.__cursor = (self.__cursor + ticks) % slots
+
+    def __advance(self, due):
+        """move the cursor one tick, collecting expired timers into `due`"""
+        self.__cursor = (self.__cursor + 1) % len(self.__slots)
+        slot = self.__slots[self.__cursor]
+        i = 0
+        end = len(slot)  # periodic timers re-linked into this slot wait a full turn
+        while i < end:
+            timer = slot[i]
+            if timer._rounds:
+                timer._rounds -= 1
+                i += 1
+                continue
+            slot.pop(i)
+            end -= 1
+            timer._slot = None
+            self.__pending -= 1
+            timer._due = True
+            due.append(timer)
+            if timer._period:
+                self.__link(timer, timer._period)
+
+    def __catch_up(self, ticks, due):
+        nearest = self.__next_expiry()
+        if nearest is not None and nearest <= ticks:
+            skip = nearest - 1
+        else:
+            skip = ticks
+        if skip > 0:
+            self.__skip(skip)
+        for _ in range(ticks - skip):
+            self.__advance(due)
+
+    def __dispatch(self, timer):
+        try:
+            self.__ready.put(timer, block=False)
+        except Queue.Full:
+            return False
+        return True
 
-    def shutdown(self):
+    def __wheel_thread_worker(self):
+        due = self.__due
+        backlog = self.__backlog
+        while True:
+            with self.__lock:
+                now = utime.ticks_ms()
+                ticks = utime.ticks_diff(now, self.__last) // self.tick_ms
+                if ticks > 0:
+                    self.__last = utime.ticks_add(self.__last, ticks * self.tick_ms)
+                    self.__catch_up(ticks, due)
+            i = 0
+            while i < len(backlog):
+                if self.__dispatch(backlog[i]):
+                    backlog.pop(i)
+                else:
+                    i += 1
+            for timer in due:
+                if timer.inline:
+                    self._fire(timer)
+                elif not self.__dispatch(timer):
+                    if timer._period:
+                        self.overruns += 1
+                    else:
+                        backlog.append(timer)
+            due.clear()
+            with self.__lock:
+                nearest = self.__next_expiry()
+                if nearest is None and not backlog:
+                    self.__idle = True
+                    self.__sleep_until = None
+                    delay = None
+                else:
+                    if backlog and (nearest is None or nearest > 1):
+                        nearest = 1  # retry the backlog on the next tick
+                    self.__sleep_until = utime.ticks_add(self.__last, nearest * self.tick_ms)
+                    delay = utime.ticks_diff(self.__sleep_until, utime.ticks_ms())
+            if delay is not None:
+                if delay <= 0:
+                    continue
+                self.__os_timer.start(delay, 0, self.__on_os_timer)
+            self.__wakeup.acquire()  # released by the os timer or _schedule
+            self.__os_timer.stop()
+
+    def __executor_thread_worker(self):
+        while True:
+            self._fire(self.__ready.get())
+
+    def _fire(self, timer):
         with self.__lock:
-            for t in self.__threads:
-                t.terminate()
-            self.__threads = set()
-            self.__work_queue = Queue()
+            # cancelled or restarted since it expired
+            if not timer._due:
+                return
+            timer._due = False
+            # taken with the due check, so a restart cannot hand this expiry its args
+            args = timer.args
+        if timer.callback is None:
+            return
+        try:
+            timer.callback(*args)
+        except Exception as e:
+            sys.print_exception(e)
+
+
+class Timer(object):
+    """Restartable one-shot or periodic timer on a `TimerWheel` (the shared one by default).
+
+    Needs neither a thread nor an `osTimer` of its own. Times are in seconds and
+    rounded up to the wheel tick. `inline` callbacks run on the wheel thread and
+    must be short and non-blocking.
+    """
+
+    def __init__(self, callback=None, args=(), inline=False, wheel=None):
+        self.callback = callback
+        self.args = args
+        self.inline = inline
+        self.__wheel = wheel
+        # owned by the wheel, under its lock
+        self._slot = None
+        self._rounds = 0
+        self._period = 0
+        self._due = False
+
+    @property
+    def wheel(self):
+        if self.__wheel is None:
+            self.__wheel = TimerWheel.default()
+        return self.__wheel
+
+    def start(self, delay, period=None, args=None):
+        """fire after `delay`, then every `period` if given; restarts an active timer.
+
+        `args`, if given, replaces the callback arguments from this start on.
+        """
+        self.wheel._schedule(self, int(delay * 1000), int(period * 1000) if period else 0, args)
+
+    def cancel(self):
+        self.wheel._cancel(self)
+
+    def is_active(self):
+        return self._slot is not None or self._due
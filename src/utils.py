@@ -7,7 +7,7 @@ import dataCall
 import checkNet
 import sys_bus
 from machine import Pin
-from usr.threading import PriorityQueue, Thread
+from usr.threading import PriorityQueue, Thread, Condition, heartbeat
 from usr.logging import getLogger
 
 
@@ -17,9 +17,12 @@ logger = getLogger(__name__)
 # ==================== 音频管理 ====================
 
 
+OPUS_SAMPLE_RATES = (8000, 16000)  # 模组 opus 编解码支持的采样率
+
+
 class AudioManager(object):
 
-    def __init__(self, channel=0, volume=10, pa_number=29):
+    def __init__(self, channel=0, volume=10, pa_number=29, sample_rate=16000, frame_duration=60):
         self.aud = audio.Audio(channel)  # 初始化音频播放通道
         self.aud.set_pa(pa_number)
         self.aud.setVolume(volume)  # 设置音量
@@ -27,6 +30,11 @@ class AudioManager(object):
         self.rec = audio.Record(channel)
         self.rec.gain_set(4,10)
         self.__skip = 0
+        self.sample_rate = sample_rate
+        self.frame_duration = frame_duration
+        self.__codec_cond = Condition(name="codec")
+        self.__codec_users = 0
+        self.__reopening = False
 
     # ========== 音频文件 ====================
 
@@ -48,9 +56,66 @@ class AudioManager(object):
 
     # ========= opus ====================
 
-    def open_opus(self):
-        self.pcm = audio.Audio.PCM(0, 1, 16000, 2, 1, 15)  # 5 -> 25
-        self.opus = Opus(self.pcm, 0, 6000)  # 6000 ~ 128000
+    def open_opus(self, sample_rate=None, frame_duration=None):
+        """打开编解码，失败时抛出异常且不修改 sample_rate / frame_duration"""
+        if sample_rate is None:
+            sample_rate = self.sample_rate
+        if frame_duration is None:
+            frame_duration = self.frame_duration
+        pcm = audio.Audio.PCM(0, 1, sample_rate, 2, 1, 15)  # 5 -> 25
+        try:
+            opus = Opus(pcm, 0, 6000)  # 6000 ~ 128000
+        except Exception:
+            pcm.close()
+            raise
+        self.pcm = pcm
+        self.opus = opus
+        self.sample_rate = sample_rate
+        self.frame_duration = frame_duration
+
+    def configure_opus(self, sample_rate, frame_duration):
+        """按服务器协商的参数调整编解码，仅在参数变化时重新打开，返回是否有变化"""
+        if sample_rate == self.sample_rate and frame_duration == self.frame_duration:
+            return False
+        if sample_rate not in OPUS_SAMPLE_RATES:
+            logger.warn("unsupported opus sample rate {} Hz, keep {} Hz", sample_rate, self.sample_rate)
+            return False
+        if sample_rate == self.sample_rate:
+            # 帧长只影响每次读取的时长，无需重新打开
+            self.frame_duration = frame_duration
+            return True
+        with self.__codec_cond:
+            # 阻止新的读写进入，等待正在进行的读写完成后再重新打开
+            self.__reopening = True
+            self.__codec_cond.wait_for(lambda: self.__codec_users == 0)
+            sample_rate_before, frame_duration_before = self.sample_rate, self.frame_duration
+            try:
+                self.close_opus()
+                try:
+                    self.open_opus(sample_rate, frame_duration)
+                except Exception as e:
+                    # 模组拒绝新参数时按原参数重新打开，保证后续读写可用
+                    logger.error("opus reopen failed, restore {} Hz, {} ms, Exception details: {}",
+                                 sample_rate_before, frame_duration_before, repr(e))
+                    self.open_opus(sample_rate_before, frame_duration_before)
+                    return False
+                logger.info("opus reopened: {} Hz, {} ms", sample_rate, frame_duration)
+            finally:
+                self.__reopening = False
+                self.__codec_cond.notify_all()
+        return True
+
+    def __enter_codec(self):
+        with self.__codec_cond:
+            if self.__reopening:
+                self.__codec_cond.wait_for(lambda: not self.__reopening)
+            self.__codec_users += 1
+
+    def __exit_codec(self):
+        with self.__codec_cond:
+            self.__codec_users -= 1
+            if self.__reopening and self.__codec_users == 0:
+                self.__codec_cond.notify_all()
     
     def close_opus(self):
         self.opus.close()
@@ -59,10 +124,18 @@ class AudioManager(object):
         del self.pcm
     
     def opus_read(self):
-        return self.opus.read(60)
+        self.__enter_codec()
+        try:
+            return self.opus.read(self.frame_duration)
+        finally:
+            self.__exit_codec()
 
     def opus_write(self, data):
-        return self.opus.write(data)
+        self.__enter_codec()
+        try:
+            return self.opus.write(data)
+        finally:
+            self.__exit_codec()
 
     # ========= vad & kws ====================
 
@@ -102,6 +175,139 @@ class AudioManager(object):
         self.rec.vad_stop()
 
 
+# ==================== 下行音频抖动缓冲 ====================
+
+
+class JitterBuffer(object):
+    """下行音频抖动缓冲
+
+    WebSocket接收线程只把opus帧放入预分配的环形槽位，由独立的播放线程写入解码器，
+    慢速解码不再阻塞socket读取。目标缓冲深度根据到达间隔抖动(RFC 3550 方式估计)
+    在 [min_depth, max_depth] 之间自适应调整，播放开始前先预缓冲到目标深度。
+    """
+
+    def __init__(self, audio_manager, frame_duration=60, capacity=16, min_depth=1, max_depth=8):
+        if not 1 <= min_depth <= max_depth < capacity:
+            raise ValueError("require 1 <= min_depth <= max_depth < capacity")
+        self.__audio_manager = audio_manager
+        self.frame_duration = frame_duration
+        self.__capacity = capacity
+        self.__slots = [None] * capacity
+        self.__head = 0
+        self.__count = 0
+        self.__min_depth = min_depth
+        self.__max_depth = max_depth
+        self.__target_depth = min_depth
+        self.__jitter = 0  # ms
+        self.__last_arrival = None
+        self.__playing = False
+        self.__starved = False
+        self.__end_of_stream = False
+        self.__cond = Condition(name="jitter_buffer")
+        self.__thread = None
+        self.underruns = 0
+        self.overruns = 0
+        self.late_frames = 0
+
+    def start(self):
+        with self.__cond:
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__playout_thread_worker, name="playout")
+                self.__thread.start(stack_size=64)
+
+    def put(self, frame):
+        """called by receive thread, never blocks on the codec"""
+        now = utime.ticks_ms()
+        with self.__cond:
+            self.__update_jitter(now)
+            # 保留一个槽位给正在播放的帧
+            if self.__count >= self.__capacity - 1:
+                self.__slots[self.__head] = None
+                self.__head = (self.__head + 1) % self.__capacity
+                self.__count -= 1
+                self.overruns += 1
+            if self.__starved:
+                self.late_frames += 1
+            self.__slots[(self.__head + self.__count) % self.__capacity] = frame
+            self.__count += 1
+            self.__end_of_stream = False
+            self.__cond.notify()
+
+    def end_stream(self):
+        """mark end of tts stream, remaining frames are played without prefill"""
+        with self.__cond:
+            self.__end_of_stream = True
+            self.__last_arrival = None
+            self.__cond.notify()
+
+    def clear(self):
+        """drop all buffered frames, e.g. on barge-in"""
+        with self.__cond:
+            for i in range(self.__capacity):
+                self.__slots[i] = None
+            self.__head = 0
+            self.__count = 0
+            self.__playing = False
+            self.__starved = False
+            self.__last_arrival = None
+
+    def stats(self):
+        with self.__cond:
+            return {
+                "depth": self.__count,
+                "target_depth": self.__target_depth,
+                "jitter_ms": self.__jitter,
+                "underruns": self.underruns,
+                "overruns": self.overruns,
+                "late_frames": self.late_frames
+            }
+
+    def __update_jitter(self, now):
+        if self.__last_arrival is not None:
+            deviation = abs(utime.ticks_diff(now, self.__last_arrival) - self.frame_duration)
+            self.__jitter += (deviation - self.__jitter) // 16
+            depth = 1 + (2 * self.__jitter + self.frame_duration - 1) // self.frame_duration
+            self.__target_depth = min(self.__max_depth, max(self.__min_depth, depth))
+        self.__last_arrival = now
+
+    def __ready(self):
+        if self.__playing or self.__end_of_stream:
+            return self.__count > 0
+        return self.__count >= self.__target_depth
+
+    def __next_frame(self):
+        with self.__cond:
+            if self.__playing and self.__count == 0:
+                if not self.__end_of_stream:
+                    self.underruns += 1
+                    self.__starved = True
+                self.__playing = False
+            while not self.__ready():
+                timeout = self.__target_depth * self.frame_duration / 1000 if self.__count > 0 else None
+                if not self.__cond.wait(timeout) and self.__count > 0:
+                    # 预缓冲等待超时，直接播放已有的帧
+                    break
+            self.__playing = True
+            self.__starved = False
+            frame = self.__slots[self.__head]
+            self.__slots[self.__head] = None
+            self.__head = (self.__head + 1) % self.__capacity
+            self.__count -= 1
+            return frame
+
+    def __playout_thread_worker(self):
+        while True:
+            # 等待下一帧可能是空闲，不计入卡顿检测
+            heartbeat()
+            frame = self.__next_frame()
+            # 一帧的解码播放应在几个帧长内完成
+            heartbeat(self.frame_duration * 4 / 1000)
+            try:
+                self.__audio_manager.opus_write(frame)
+            except Exception as e:
+                logger.error("jitter buffer playout failed, Exception details: {}", repr(e))
+
+
 # ==================== 充电管理 ====================
 
 
@@ -129,7 +335,7 @@ class NetManager(object):
     def __net_callback(self, args):
         if args[1] == 0:
             sys_bus.publish("NET_STATE_CHANGE", dict(state="net_disconnect"))
-            Thread(target=self.wait_network_ready).start()
+            Thread(target=self.wait_network_ready, name="net_wait").start()
         else:
             sys_bus.publish("NET_STATE_CHANGE", dict(state="net_connected"))
 
@@ -194,8 +400,8 @@ class _Task(object):
 class TaskManager(object):
 
     def __init__(self):
-        self.__q = PriorityQueue()
-        self.__main_thread = Thread(target=self.__main_loop)
+        self.__q = PriorityQueue(name="task_manager")
+        self.__main_thread = Thread(target=self.__main_loop, name="task_manager")
         
     def __main_loop(self):
         while True:
@@ -203,7 +409,7 @@ class TaskManager(object):
             try:
                 task.run()
             except Exception as e:
-                logger.error("{} run failed, Exception details: {}".format(task, repr(e)))
+                logger.error("{} run failed, Exception details: {}", task, repr(e))
             else:
                 pass
     
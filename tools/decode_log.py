@@ -0,0 +1,67 @@
+"""
+Decode log files written by `usr.logging.RotatingFileStream` (host side).
+
+Files are read oldest first: <path>.N ... <path>.1, <path>.
+
+    python tools/decode_log.py app.log
+    python tools/decode_log.py app.log.2 app.log.1 app.log
+"""
+import os
+import sys
+import struct
+import time
+
+RECORD_LOG = 1
+RECORD_EVENT = 2
+HEADER = struct.Struct(">BH")
+
+
+def rotated_files(path):
+    files = []
+    index = 1
+    while os.path.exists("{}.{}".format(path, index)):
+        files.append("{}.{}".format(path, index))
+        index += 1
+    files.reverse()
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def decode(data):
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        record_type, length = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        payload = data[offset:offset + length]
+        offset += length
+        if len(payload) < length:
+            yield "!! truncated record at offset {}".format(offset - length - HEADER.size)
+            return
+        if record_type == RECORD_LOG:
+            yield payload.decode("utf-8", "replace")
+        elif record_type == RECORD_EVENT and length >= 4:
+            timestamp = struct.unpack_from(">I", payload)[0]
+            yield "[{}][EVENT] {}".format(
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)),
+                payload[4:].decode("utf-8", "replace")
+            )
+        else:
+            yield "!! unknown record type {} ({} bytes)".format(record_type, length)
+
+
+def main(argv):
+    if not argv:
+        sys.stderr.write(__doc__)
+        return 1
+    files = rotated_files(argv[0]) if len(argv) == 1 else argv
+    for path in files:
+        with open(path, "rb") as f:
+            data = f.read()
+        for line in decode(data):
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))